@@ -2,16 +2,120 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import argparse
+import hashlib
+import os
 import ssl
+import threading
+from functools import partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 
-httpd = HTTPServer(('localhost', 8888), SimpleHTTPRequestHandler)
+class FileCache(object):
+    """Contents of served files, kept until they change on disk."""
 
-context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-context.load_cert_chain("server.cert", "server.key")
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
 
-# Set the SSL context for the server
-httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+    def get(self, path):
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached is None or cached[0] != key:
+            with open(path, "rb") as f:
+                body = f.read()
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            cached = (key, body, etag, stat.st_mtime)
+            with self._lock:
+                self._files[path] = cached
+        return cached[1:]
 
-httpd.serve_forever()
+
+class SearchRequestHandler(SimpleHTTPRequestHandler):
+    """Serves the SERP fixtures from memory over keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+    timeout = 30  # drop idle keep-alive connections
+
+    def __init__(self, *args, cache=None, **kwargs):
+        self.cache = cache
+        super().__init__(*args, **kwargs)
+
+    def setup(self):
+        # The TLS handshake runs here, on the request's own thread, instead of
+        # in accept() where it would hold up every other connection.
+        self.request.settimeout(self.timeout)
+        self.request.do_handshake()
+        super().setup()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        try:
+            body, etag, mtime = self.cache.get(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", self.date_time_string(mtime))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        return body
+
+    def do_GET(self):
+        body = self.send_head()
+        if isinstance(body, bytes):
+            self.wfile.write(body)
+        elif body:
+            try:
+                self.copyfile(body, self.wfile)
+            finally:
+                body.close()
+
+    def do_HEAD(self):
+        body = self.send_head()
+        if body and not isinstance(body, bytes):
+            body.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="HTTPS server for the search tests")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--cert", default="server.cert")
+    parser.add_argument("--key", default="server.key")
+    parser.add_argument("--directory", default=os.getcwd())
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    handler = partial(SearchRequestHandler, directory=args.directory, cache=FileCache())
+    httpd = ThreadingHTTPServer((args.host, args.port), handler)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(args.cert, args.key)
+
+    # Set the SSL context for the server
+    httpd.socket = context.wrap_socket(
+        httpd.socket, server_side=True, do_handshake_on_connect=False
+    )
+
+    httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
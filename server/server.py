@@ -2,18 +2,34 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
+import queue
+import re
+import shlex
+import shutil
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields
 from pathlib import Path
 from urllib.parse import urlparse
 
-from flask import Flask, request, send_from_directory
+from flask import Flask, abort, request, send_file, send_from_directory
 from flask.json import jsonify
 from werkzeug.utils import secure_filename
 
-
-URLS = []
-ALLOWED_EXTENSIONS = set(["html", "htm"])
+ALLOWED_EXTENSIONS = set(
+    ["html", "htm", "css", "js", "json", "png", "jpg", "jpeg", "gif", "svg", "txt", "log"]
+)
+CHUNK_SIZE = 1024 * 1024
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg+xml")
 
 path = Path("files")
 path.mkdir(exist_ok=True)
@@ -21,27 +37,417 @@ path.mkdir(exist_ok=True)
 app = Flask("klaatu_server")
 app.secret_key = "secret key"
 app.config["UPLOAD_FOLDER"] = path.absolute()
-app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("KLAATU_MAX_UPLOAD", 1024 * 1024 * 1024))
 app.config["SERVER_TYPE"] = os.getenv("KLAATU_SERVER_TYPE", "client")
+app.config["JOBS_DIR"] = Path(os.getenv("KLAATU_JOBS_DIR", "jobs")).absolute()
+app.config["MAX_JOBS"] = int(os.getenv("KLAATU_MAX_JOBS", 1))
+app.config["PYTEST_COMMAND"] = os.getenv("KLAATU_PYTEST_COMMAND", "pipenv run pytest")
+app.config["DATABASE"] = os.getenv("KLAATU_DATABASE", "klaatu.db")
+
+COLLECTED = re.compile(r"collected (\d+) items?")
+OUTCOME = re.compile(r" (PASSED|FAILED|ERROR|SKIPPED|XFAIL|XPASS)\b")
+
+
+@dataclass
+class Job:
+    """One pytest run requested through ``/run``."""
+
+    id: str
+    slug: str | None = None
+    branch: str | None = None
+    server: str | None = None
+    state: str = "queued"  # queued, running, passed, failed
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    returncode: int | None = None
+    collected: int | None = None
+    outcomes: dict = field(default_factory=dict)
+    # Held by the worker while it updates the job and by readers taking a copy.
+    lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def workdir(self):
+        return app.config["JOBS_DIR"] / self.id
+
+    def command(self):
+        command = shlex.split(app.config["PYTEST_COMMAND"])
+        for option, value in (
+            ("--experiment-slug", self.slug),
+            ("--experiment-branch", self.branch),
+            ("--experiment-server", self.server),
+        ):
+            if value:
+                command += [option, value]
+        return command + [
+            f"--html={self.workdir / 'report.html'}",
+            f"--ping-log-dir={self.workdir / 'pings'}",
+            f"--timings-json={self.workdir / 'timings.json'}",
+        ]
+
+    def to_dict(self):
+        with self.lock:
+            job = {item.name: getattr(self, item.name) for item in fields(self) if item.init}
+            job["outcomes"] = dict(self.outcomes)
+        return {**job, "progress": sum(job["outcomes"].values()), "log": f"/run/{self.id}/log"}
+
+
+class JobQueue(object):
+    """Runs queued jobs on a fixed number of worker threads.
+
+    Every job runs pytest in the tests directory with its own working
+    directory for the log and reports, so the server's cwd never changes and
+    concurrent jobs don't share output files.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, job):
+        with self._lock:
+            self.jobs[job.id] = job
+            if not self._threads:
+                for number in range(self.workers):
+                    thread = threading.Thread(target=self._work, name=f"job-{number}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def snapshot(self):
+        """The jobs submitted so far, safe to iterate while jobs are submitted."""
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                app.logger.exception(f"Job {job.id} failed to run: {e}")
+                with job.lock:
+                    job.state = "failed"
+                    job.finished = time.time()
+                if job.slug and (REGISTRY.get(job.slug) or {}).get("state") == "RUNNING":
+                    REGISTRY.transition(job.slug, "READY")
+
+    def _run(self, job):
+        job.workdir.mkdir(parents=True, exist_ok=True)
+        with job.lock:
+            job.state = "running"
+            job.started = time.time()
+        with open(job.workdir / "output.log", "w") as log:
+            process = subprocess.Popen(
+                job.command(),
+                cwd=os.getenv("TESTS_DIR"),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            for line in process.stdout:
+                log.write(line)
+                log.flush()
+                if match := COLLECTED.search(line):
+                    with job.lock:
+                        job.collected = int(match.group(1))
+                elif match := OUTCOME.search(line):
+                    outcome = match.group(1).lower()
+                    with job.lock:
+                        job.outcomes[outcome] = job.outcomes.get(outcome, 0) + 1
+        returncode = process.wait()
+        with job.lock:
+            job.returncode = returncode
+            job.finished = time.time()
+            job.state = "passed" if returncode == 0 else "failed"
+            outcomes = dict(job.outcomes)
+        if job.slug and REGISTRY.get(job.slug):
+            # A failed run leaves the experiment READY for the next attempt.
+            REGISTRY.transition(
+                job.slug,
+                "COMPLETED" if returncode == 0 else "READY",
+                results={"returncode": returncode, "outcomes": outcomes},
+            )
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+class ExperimentRegistry(object):
+    """Experiments keyed by slug, stored in SQLite.
+
+    Experiments follow the lifecycle in docs/sequences.md:
+    IDLE -> READY -> RUNNING -> COMPLETED -> IDLE, and RUNNING -> READY when a
+    run errored. Listing by state uses an index on the state column.
+    """
+
+    TRANSITIONS = {
+        "IDLE": {"READY"},
+        "READY": {"RUNNING"},
+        "RUNNING": {"COMPLETED", "READY"},
+        "COMPLETED": {"IDLE"},
+    }
+
+    def __init__(self, database):
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS experiments (
+                    slug TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    job TEXT,
+                    results TEXT
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS experiments_state ON experiments (state, updated)"
+            )
+
+    def add(self, slug, url):
+        """Register an experiment, or make a known one READY for another run.
+
+        A completed experiment restarts its testing cycle through IDLE. A
+        running one can't be requested again until its job is done.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT state FROM experiments WHERE slug = ?", (slug,)
+            ).fetchone()
+            if row is None:
+                self._db.execute(
+                    "INSERT INTO experiments (slug, url, state, created, updated)"
+                    " VALUES (?, ?, 'READY', ?, ?)",
+                    (slug, url, now, now),
+                )
+            elif row["state"] == "RUNNING":
+                raise InvalidTransition(f"{slug} is RUNNING, its job has to finish first")
+            else:
+                states = [row["state"]]
+                if row["state"] == "COMPLETED":
+                    states.append("IDLE")
+                if row["state"] != "READY":
+                    states.append("READY")
+                for current, state in zip(states, states[1:]):
+                    self._check_transition(slug, current, state)
+                self._db.execute(
+                    "UPDATE experiments SET url = ?, state = 'READY', updated = ? WHERE slug = ?",
+                    (url, now, slug),
+                )
+        return self.get(slug)
+
+    def get(self, slug):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM experiments WHERE slug = ?", (slug,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, state=None):
+        with self._lock:
+            if state:
+                rows = self._db.execute(
+                    "SELECT * FROM experiments WHERE state = ? ORDER BY updated", (state,)
+                ).fetchall()
+            else:
+                rows = self._db.execute("SELECT * FROM experiments ORDER BY created").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def transition(self, slug, state, job=None, results=None):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT state FROM experiments WHERE slug = ?", (slug,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(slug)
+            self._check_transition(slug, row["state"], state)
+            self._db.execute(
+                "UPDATE experiments SET state = ?, updated = ?, job = COALESCE(?, job),"
+                " results = COALESCE(?, results) WHERE slug = ?",
+                (state, time.time(), job, json.dumps(results) if results else None, slug),
+            )
+        return self.get(slug)
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM experiments")
+
+    def _check_transition(self, slug, current, state):
+        if state not in self.TRANSITIONS[current]:
+            raise InvalidTransition(f"{slug} can't go from {current} to {state}")
+
+    @staticmethod
+    def _to_dict(row):
+        item = dict(row)
+        item["results"] = json.loads(item["results"]) if item["results"] else None
+        return item
+
+
+class ResultStore(object):
+    """Uploaded test results, stored once per distinct content.
+
+    Files are streamed to ``root/blobs`` under their SHA-256 while they are
+    hashed, so a report or asset uploaded by several runs is only kept once.
+    An index in SQLite maps result names, such as ``<run>/report.html`` or
+    ``<run>/assets/style.css``, to blobs.
+    """
+
+    def __init__(self, root, database):
+        self.blobs = Path(root) / "blobs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    name TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    content_type TEXT NOT NULL,
+                    uploaded REAL NOT NULL
+                )
+                """
+            )
+
+    def put(self, name, stream):
+        digest = hashlib.sha256()
+        size = 0
+        f = tempfile.NamedTemporaryFile(dir=self.blobs, delete=False)
+        try:
+            with f:
+                while chunk := stream.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            blob = self.blob_path(digest.hexdigest())
+            if not blob.exists():
+                blob.parent.mkdir(exist_ok=True)
+                os.replace(f.name, blob)
+        finally:
+            # Still there when the upload was interrupted or the blob was known.
+            if os.path.exists(f.name):
+                os.unlink(f.name)
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (name, digest.hexdigest(), size, content_type, time.time()),
+            )
+        return self.get(name)
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM results WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, prefix=""):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM results WHERE substr(name, 1, ?) = ? ORDER BY uploaded DESC",
+                (len(prefix), prefix),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def blob_path(self, sha256):
+        return self.blobs / sha256[:2] / sha256
+
+    def gzipped(self, sha256):
+        """A gzip copy of a blob, made the first time it is asked for."""
+        path = self.blob_path(sha256).with_suffix(".gz")
+        if not path.exists():
+            with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+                with open(self.blob_path(sha256), "rb") as source, gzip.GzipFile(
+                    fileobj=f, mode="wb", mtime=0
+                ) as target:
+                    shutil.copyfileobj(source, target, CHUNK_SIZE)
+            os.replace(f.name, path)
+        return path
+
+
+JOBS = JobQueue(app.config["MAX_JOBS"])
+RESULTS = ResultStore(app.config["UPLOAD_FOLDER"], app.config["DATABASE"])
+REGISTRY = ExperimentRegistry(app.config["DATABASE"])
 
 
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def result_name(filename):
+    """``filename`` made safe, keeping its directories."""
+    parts = [secure_filename(part) for part in filename.replace("\\", "/").split("/")]
+    return "/".join(part for part in parts if part)
+
+
 @app.route("/test_results", methods=["POST", "GET"])
 def test_results():
-    request_file = request.files["file"]
     if request.method == "POST":
-        if request_file and allowed_file(request_file.filename):
-            filename = secure_filename(request_file.filename)
-            request_file.save(os.path.join(app.config["UPLOAD_FOLDER"], filename))
-            resp = jsonify({"message": "File successfully uploaded"})
-            resp.status_code = 201
+        prefix = result_name(request.form.get("run", ""))
+        stored = []
+        for request_file in request.files.getlist("file"):
+            if request_file and allowed_file(request_file.filename):
+                name = result_name(request_file.filename)
+                stored.append(RESULTS.put(f"{prefix}/{name}" if prefix else name, request_file))
+        if not stored:
+            resp = jsonify({"message": "No allowed file in the upload"})
+            resp.status_code = 400
+            return resp
+        resp = jsonify({"message": "File successfully uploaded", "files": stored})
+        resp.status_code = 201
         return resp
     elif request.method == "GET":
-        item = send_from_directory(os.path.join(app.config["UPLOAD_FOLDER"]), filename)
-        return item
+        if filename := request.args.get("filename"):
+            return test_result(filename)
+        return jsonify(RESULTS.list(request.args.get("prefix", "")))
+
+
+@app.route("/test_results/<path:filename>", methods=["GET", "PUT"])
+def test_result(filename):
+    name = result_name(filename)
+    if request.method == "PUT":
+        if not allowed_file(name):
+            abort(400)
+        resp = jsonify(RESULTS.put(name, request.stream))
+        resp.status_code = 201
+        return resp
+    if not (item := RESULTS.get(name)):
+        abort(404)
+    blob = RESULTS.blob_path(item["sha256"])
+    if (
+        "gzip" in request.accept_encodings
+        and "Range" not in request.headers
+        and item["content_type"].startswith(COMPRESSIBLE)
+    ):
+        resp = send_file(
+            RESULTS.gzipped(item["sha256"]),
+            mimetype=item["content_type"],
+            etag=f"{item['sha256']}-gzip",
+            conditional=True,
+        )
+        resp.headers["Content-Encoding"] = "gzip"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+    # conditional=True answers Range requests with 206 and partial content.
+    return send_file(
+        blob, mimetype=item["content_type"], etag=item["sha256"], conditional=True
+    )
 
 
 @app.route(
@@ -54,43 +460,104 @@ def submit():
         url = urlparse(request_data["experiment_url"])
         # build url
         experiment_name = request_data["experiment_url"].split("/")[-2]
-        URLS.append(f"{url.scheme}://{url.netloc}/api/v6/experiments/{experiment_name}")
+        try:
+            REGISTRY.add(
+                experiment_name,
+                f"{url.scheme}://{url.netloc}/api/v6/experiments/{experiment_name}",
+            )
+        except InvalidTransition as e:
+            resp = jsonify(str(e))
+            resp.status_code = 409
+            return resp
         resp = jsonify("")
         resp.status_code = 201
     if request.method == "PUT":
         request_data = request.get_json()
         experiment_name = request_data["url"].split("/")[-2]
-        for count, item in enumerate(URLS):
-            if experiment_name in item:
-                URLS[count] = {item: "tested"}
+        experiment = REGISTRY.get(experiment_name)
+        if experiment is None:
+            abort(404)
+        # Without a state this marks the experiment as tested, like it used to.
+        state = request_data.get("state", "COMPLETED")
+        try:
+            if state == "COMPLETED" and experiment["state"] == "READY":
+                REGISTRY.transition(experiment_name, "RUNNING")
+            # Repeating a PUT is a no-op that succeeds, as it always did.
+            if state != experiment["state"]:
+                REGISTRY.transition(experiment_name, state, results=request_data.get("results"))
+        except InvalidTransition as e:
+            resp = jsonify(str(e))
+            resp.status_code = 409
+            return resp
         resp = jsonify("Success")
         resp.status_code = 200
     if request.method == "GET":
-        resp = jsonify(URLS)
+        # Tested experiments are listed as {url: "tested"}, like they always were.
+        resp = jsonify(
+            [
+                {item["url"]: "tested"} if item["state"] == "COMPLETED" else item["url"]
+                for item in REGISTRY.list(request.args.get("state"))
+            ]
+        )
         resp.status_code = 200
     if request.method == "DELETE":
-        URLS.clear()
+        REGISTRY.clear()
         resp = jsonify("URLS cleared")
         resp.status_code = 200
     return resp
 
 
+@app.route("/experiment/<slug>", methods=["GET"])
+def experiment(slug):
+    if not (item := REGISTRY.get(slug)):
+        abort(404)
+    return jsonify(item)
+
+
 @app.route(
     "/run",
-    methods=["POST"],
+    methods=["POST", "GET"],
 )
 def run():
-    test_location = os.getenv("TESTS_DIR")
-    os.chdir(test_location)
-    command = "pipenv run pytest"
-    subprocess.Popen(
-        command, shell=True
+    if request.method == "GET":
+        return jsonify([job.to_dict() for job in JOBS.snapshot()])
+    request_data = request.get_json(silent=True) or {}
+    job = Job(
+        id=uuid.uuid4().hex,
+        slug=request_data.get("slug"),
+        branch=request_data.get("branch"),
+        server=request_data.get("server"),
     )
-    resp = jsonify("Success")
-    resp.status_code = 200
+    if job.slug and REGISTRY.get(job.slug):
+        try:
+            REGISTRY.transition(job.slug, "RUNNING", job=job.id)
+        except InvalidTransition as e:
+            resp = jsonify(str(e))
+            resp.status_code = 409
+            return resp
+    JOBS.submit(job)
+    resp = jsonify(job.to_dict())
+    resp.status_code = 202
+    resp.headers["Location"] = f"/run/{job.id}"
     return resp
 
 
+@app.route("/run/<job_id>", methods=["GET"])
+def run_status(job_id):
+    if not (job := JOBS.get(job_id)):
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@app.route("/run/<job_id>/log", methods=["GET"])
+def run_log(job_id):
+    if not (job := JOBS.get(job_id)):
+        abort(404)
+    if not (job.workdir / "output.log").exists():
+        return "", 200, {"Content-Type": "text/plain"}
+    return send_from_directory(job.workdir, "output.log", mimetype="text/plain")
+
+
 @app.route("/", methods=["GET"])
 def ping():
     resp = jsonify("Hello")
@@ -5,7 +5,9 @@
 import logging
 import os
 import random
+import socket
 import subprocess
+import tempfile
 import time
 from pathlib import Path
 
@@ -58,25 +60,38 @@ def pytest_runtest_setup(item):
             pytest.skip("test does not match feature name")
 
 
-def start_process(path, command):
+def start_process(path, command, port, host="localhost", timeout=30):
+    """Start a server and return once it accepts connections on ``port``.
+
+    The port is probed with an exponential backoff. Output is written to a log
+    file instead of a pipe nobody drains, which could otherwise block the child.
+    """
     module_path = Path(path)
+    log_path = Path(tempfile.gettempdir()) / f"klaatu-{module_path.name}-{port}.log"
 
-    try:
+    with open(log_path, "w") as log:
         process = subprocess.Popen(
             command,
-            encoding="utf-8",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
+            stdout=log,
+            stderr=subprocess.STDOUT,
             cwd=module_path.absolute(),
         )
-        stdout, stderr = process.communicate(timeout=5)
-
-        if process.returncode != 0:
-            raise Exception(stderr)
-    except subprocess.TimeoutExpired:
-        logging.info(f"{module_path.name} started")
-        return process
+    deadline = time.time() + timeout
+    delay = 0.05
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(
+                f"{module_path.name} exited with {process.returncode}: {log_path.read_text()}"
+            )
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                logging.info(f"{module_path.name} server started, logging to {log_path}")
+                return process
+        except OSError:
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+    process.kill()
+    raise Exception(f"{module_path.name} did not listen on port {port} within {timeout} seconds")
 
 
 @pytest.fixture(name="nimbus_cli_args")
@@ -117,40 +132,62 @@ def fixture_experiment_feature(request):
     return request.config.getoption("--experiment-feature")
 
 
+@pytest.fixture(name="wait_for_ping")
+def fixture_wait_for_ping(variables):
+    def _wait_for_ping(timeout=60, after=0, **predicate):
+        """Block on the ping server until a ping newer than the ``after`` cursor
+        matching ``predicate`` arrives. Returns the pings and the next cursor."""
+        deadline = time.time() + timeout
+        while (remaining := deadline - time.time()) > 0:
+            params = {"timeout": min(remaining, 30), "after": after, **predicate}
+            try:
+                data = requests.get(
+                    f"{variables['urls']['telemetry_server']}/pings/wait",
+                    params=params,
+                    timeout=params["timeout"] + 5,
+                ).json()
+            except (requests.Timeout, requests.ConnectionError):
+                logging.warning("Failed to wait for pings from server, retrying...")
+                time.sleep(1)
+                continue
+            if data["pings"]:
+                return data["pings"], data["cursor"]
+            after = data["cursor"]
+        return [], after
+
+    return _wait_for_ping
+
+
 @pytest.fixture(name="check_ping_for_experiment")
-def fixture_check_ping_for_experiment(experiment_slug, variables):
+def fixture_check_ping_for_experiment(experiment_slug, wait_for_ping):
     def _check_ping_for_experiment(branch=None, experiment=experiment_slug, reason=None):
         model = TelemetryModel(branch=branch, experiment=experiment)
+        names = ["enrollment"] if reason == "enrollment" else ["unenrollment", "disqualification"]
 
         timeout = time.time() + 60 * 5
+        cursor = 0
         while time.time() < timeout:
-            data = requests.get(
-                f"{variables['urls']['telemetry_server']}/pings", timeout=10
-            ).json()
-            events = []
+            data, cursor = wait_for_ping(
+                timeout=timeout - time.time(),
+                after=cursor,
+                event=",".join(names),
+                experiment=experiment,
+                branch=branch,
+                summary=1,
+            )
             for item in data:
-                event_items = item.get("events")
-                if event_items:
-                    for event in event_items:
-                        if (
-                            "category" in event
-                            and "nimbus_events" in event["category"]
-                            and "extra" in event
-                            and "branch" in event["extra"]
-                        ):
-                            events.append(event)
-            for event in events:
-                event_name = event.get("name")
-                if (reason == "enrollment" and event_name == "enrollment") or (
-                    reason == "unenrollment" and event_name in ["unenrollment", "disqualification"]
-                ):
-                    telemetry_model = TelemetryModel(
-                        branch=event["extra"]["branch"],
-                        experiment=event["extra"]["experiment"],
-                    )
-                    if model == telemetry_model:
-                        return True
-            time.sleep(5)
+                for event in item.get("events") or []:
+                    if (
+                        "nimbus_events" in event.get("category", "")
+                        and event.get("name") in names
+                        and "branch" in event.get("extra", {})
+                    ):
+                        telemetry_model = TelemetryModel(
+                            branch=event["extra"]["branch"],
+                            experiment=event["extra"]["experiment"],
+                        )
+                        if model == telemetry_model:
+                            return True
         return False
 
     return _check_ping_for_experiment
@@ -242,7 +279,7 @@ def gradlewbuild(gradlewbuild_log):
 @pytest.fixture(name="ping_server", autouse=True, scope="session")
 def fixture_ping_server():
     path = next(iter(here.glob("**/ping_server")))
-    process = start_process(path, ["python", "ping_server.py"])
+    process = start_process(path, ["python", "ping_server.py"], port=5000)
     yield "http://localhost:5000"
     process.terminate()
 
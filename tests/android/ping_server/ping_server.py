@@ -2,47 +2,668 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import argparse
 import json
+import logging
+import mmap
 import os
+import re
+import sys
+import threading
+import time
 import zlib
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from types import ModuleType
+from typing import Callable
 
-from flask import Flask, request
+from flask import Blueprint, Flask, abort, request
 from flask.json import jsonify
+from werkzeug.serving import BaseWSGIServer
+
+resource: ModuleType | None
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
 app = Flask("ping_server")
 
-PINGS = []
+INDEXED_FIELDS = ("namespace", "doc_type", "experiment", "branch")
+MAX_WAIT_TIMEOUT = 300
+CHUNK_SIZE = 64 * 1024
+# Limits are read from the environment, 0 disables a limit.
+MAX_PING_BYTES = int(os.environ.get("PING_SERVER_MAX_PING_BYTES", 32 * 1024 * 1024))
+MAX_PINGS = int(os.environ.get("PING_SERVER_MAX_PINGS", 0))
+MAX_BYTES = int(os.environ.get("PING_SERVER_MAX_BYTES", 0))
+MAX_AGE = float(os.environ.get("PING_SERVER_MAX_AGE", 0))
+DEFAULT_BUCKET = "default"
+BUCKET_NAME = re.compile(r"[\w.-]+")
+
+
+@dataclass
+class PingRecord:
+    """A stored ping along with the fields it is indexed by.
+
+    Replayed records leave ``body`` empty and read the ping through ``loader``.
+    """
+
+    seq: int
+    namespace: str
+    doc_type: str | None
+    experiments: dict[str, str | None] = field(default_factory=dict)
+    events: list[dict] = field(default_factory=list)
+    session: dict = field(default_factory=dict)
+    body: dict | None = None
+    size: int = 0
+    received: float = field(default_factory=time.time)
+    loader: Callable[[], dict] | None = None
+
+    @property
+    def ping(self):
+        return self.body if self.loader is None else self.loader()
+
+    def summary(self):
+        """The fields pollers check, without the rest of the ping body."""
+        return {
+            "seq": self.seq,
+            "namespace": self.namespace,
+            "doc_type": self.doc_type,
+            "experiments": {slug: {"branch": branch} for slug, branch in self.experiments.items()},
+            "events": self.events,
+            "session": self.session,
+            "size": self.size,
+            "received": self.received,
+        }
+
+    def index_keys(self):
+        yield ("namespace", self.namespace)
+        if self.doc_type:
+            yield ("doc_type", self.doc_type)
+        for experiment, branch in self.experiments.items():
+            yield ("experiment", experiment)
+            if branch:
+                yield ("branch", branch)
+
+    def matches(self, namespace=None, doc_type=None, experiment=None, branch=None, event=None):
+        if event is not None and not self.has_nimbus_event(event, experiment, branch):
+            return False
+        if namespace is not None and self.namespace != namespace:
+            return False
+        if doc_type is not None and self.doc_type != doc_type:
+            return False
+        if experiment is not None:
+            if experiment not in self.experiments:
+                return False
+            if branch is not None and self.experiments[experiment] != branch:
+                return False
+        elif branch is not None and branch not in self.experiments.values():
+            return False
+        return True
+
+    def has_nimbus_event(self, names, experiment=None, branch=None):
+        """Check for a Nimbus event named in ``names`` for the experiment and branch."""
+        for event in self.events:
+            extra = event["extra"]
+            if (
+                event.get("name") in names
+                and experiment in (None, extra.get("experiment"))
+                and branch in (None, extra.get("branch"))
+            ):
+                return True
+        return False
+
+
+def parse_submit_path(telemetry, ping):
+    """Return the namespace and document type of a submission path.
+
+    Legacy telemetry submits to ``telemetry/<doc_id>/<doc_type>/...`` while
+    Glean submits to ``<namespace>/<doc_type>/<doc_version>/<doc_id>``.
+    """
+    parts = telemetry.strip("/").split("/")
+    namespace = parts[0]
+    if namespace == "telemetry":
+        doc_type = parts[2] if len(parts) > 2 else ping.get("type")
+    else:
+        doc_type = parts[1] if len(parts) > 1 else None
+    return namespace, doc_type
+
+
+def extract_nimbus_events(ping):
+    """Return the Nimbus events of a Glean ping as ``{category, name, extra}``."""
+    return [
+        {
+            "category": event["category"],
+            "name": event.get("name"),
+            "extra": event.get("extra") or {},
+        }
+        for event in ping.get("events") or []
+        if isinstance(event, dict) and "nimbus_events" in event.get("category", "")
+    ]
+
+
+def extract_experiments(ping, events):
+    """Collect ``{experiment slug: branch}`` from every place a ping reports them."""
+    experiments = {}
+    for container in (ping.get("environment"), ping.get("ping_info")):
+        if not isinstance(container, dict):
+            continue
+        for slug, data in (container.get("experiments") or {}).items():
+            experiments[slug] = data.get("branch") if isinstance(data, dict) else None
+    for event in events:
+        if "experiment" in event["extra"]:
+            experiments.setdefault(event["extra"]["experiment"], event["extra"].get("branch"))
+    return experiments
+
+
+def extract_session(ping):
+    """Return the session information of a legacy telemetry ping."""
+    info = (ping.get("payload") or {}).get("info")
+    if not isinstance(info, dict):
+        return {}
+    return {
+        key: info[key]
+        for key in ("reason", "sessionLength", "subsessionLength", "subsessionCounter")
+        if key in info
+    }
+
+
+class PingStore:
+    """Thread safe store of received pings.
+
+    Every ping gets a monotonic sequence number and is indexed by namespace,
+    document type, experiment slug and branch so that queries only walk the
+    pings that can possibly match. The oldest pings are evicted once any of
+    ``max_pings``, ``max_bytes`` or ``max_age`` (seconds) is exceeded.
+    """
+
+    def __init__(self, max_pings=0, max_bytes=0, max_age=0, log=None, read_only=False):
+        self.max_pings = max_pings
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.log = log
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._added = threading.Condition(self._lock)
+        self._seq = 0
+        self._bytes = 0
+        self._records = OrderedDict()
+        self._indexes = defaultdict(deque)
+        self._evicted = {"count": 0, "bytes": 0, "age": 0}
+        self._rejected = 0
+
+    def add(self, telemetry, ping, size=0, seq=None, received=None, loader=None):
+        """Store a ping received on ``/submit/<telemetry>``.
+
+        ``seq``, ``received`` and ``loader`` are only given when replaying a
+        ping log, in which case the ping body is not kept in memory.
+        """
+        namespace, doc_type = parse_submit_path(telemetry, ping)
+        events = extract_nimbus_events(ping)
+        with self._lock:
+            self._seq = seq or self._seq + 1
+            record = PingRecord(
+                seq=self._seq,
+                namespace=namespace,
+                doc_type=doc_type,
+                experiments=extract_experiments(ping, events),
+                events=events,
+                session=extract_session(ping),
+                body=None if loader else ping,
+                size=size,
+                received=received or time.time(),
+                loader=loader,
+            )
+            if self.log is not None:
+                self.log.append(record, telemetry, ping)
+            self._records[record.seq] = record
+            self._bytes += record.size
+            for key in record.index_keys():
+                self._indexes[key].append(record.seq)
+            self._evict()
+            self._added.notify_all()
+        return record
+
+    def get(self, seq):
+        with self._lock:
+            return self._records.get(seq)
+
+    def reject(self):
+        """Count a ping that was refused for being too large."""
+        with self._lock:
+            self._rejected += 1
+
+    def stats(self):
+        with self._lock:
+            self._evict()
+            return {
+                "pings": len(self._records),
+                "bytes": self._bytes,
+                "cursor": self._seq,
+                "evicted": dict(self._evicted),
+                "rejected": self._rejected,
+                "limits": {
+                    "max_pings": self.max_pings,
+                    "max_bytes": self.max_bytes,
+                    "max_age": self.max_age,
+                },
+            }
+
+    def _evict(self):
+        """Drop the oldest records until the retention limits are met."""
+        expiry = time.time() - self.max_age
+        while self._records:
+            oldest = next(iter(self._records.values()))
+            if self.max_pings and len(self._records) > self.max_pings:
+                reason = "count"
+            elif self.max_bytes and self._bytes > self.max_bytes:
+                reason = "bytes"
+            elif self.max_age and oldest.received < expiry:
+                reason = "age"
+            else:
+                break
+            self._evicted[reason] += 1
+            self._remove_oldest()
+
+    def _remove_oldest(self):
+        seq, record = self._records.popitem(last=False)
+        self._bytes -= record.size
+        # Records are evicted oldest first so they are always at the head of an index.
+        for key in record.index_keys():
+            seqs = self._indexes[key]
+            seqs.popleft()
+            if not seqs:
+                del self._indexes[key]
+
+    def query(self, since=0, **filters):
+        """Return the records newer than ``since`` matching every given filter.
+
+        The latest sequence number is returned alongside the records so callers
+        can resume from it without missing pings that arrive in between.
+        """
+        with self._lock:
+            return self._query(since, filters), self._seq
+
+    def wait(self, timeout, since=0, **filters):
+        """Block until a record matching ``filters`` exists or ``timeout`` seconds pass."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while not (matches := self._query(since, filters)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._added.wait(remaining)
+            return matches, self._seq
+
+    def _query(self, since, filters):
+        if self.max_age:
+            self._evict()
+        filters = {key: value for key, value in filters.items() if value is not None}
+        indexed = [(key, filters[key]) for key in INDEXED_FIELDS if key in filters]
+        if indexed:
+            # Walk the smallest matching index, newest first.
+            seqs = reversed(min((self._indexes.get(item, ()) for item in indexed), key=len))
+        else:
+            seqs = reversed(self._records)
+        matches = []
+        for seq in seqs:
+            if seq <= since:
+                break
+            record = self._records[seq]
+            if record.matches(**filters):
+                matches.append(record)
+        matches.reverse()
+        return matches
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._indexes.clear()
+            self._bytes = 0
+
+
+class PingLog:
+    """Append-only JSON lines log of every ping a store receives.
+
+    Each line holds the sequence number, submission path, receive time and
+    ping so that a session can be replayed with ``--replay`` after the fact.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, record, telemetry, ping):
+        entry = {
+            "seq": record.seq,
+            "path": telemetry,
+            "received": record.received,
+            "size": record.size,
+            "ping": ping,
+        }
+        self._file.write(f"{json.dumps(entry, separators=(',', ':'))}\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def replay_log(path, store):
+    """Load a ping log into ``store``.
+
+    The log is memory-mapped and only the index and summary of each ping are
+    kept in memory; full pings are decoded from the map when requested.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    start = 0
+    while start < len(log):
+        end = log.find(b"\n", start)
+        end = len(log) if end == -1 else end
+        if end > start:
+            entry = json.loads(log[start:end])
+            store.add(
+                entry["path"],
+                entry["ping"],
+                size=entry.get("size", end - start),
+                seq=entry["seq"],
+                received=entry["received"],
+                loader=partial(read_logged_ping, log, start, end),
+            )
+        start = end + 1
+
+
+def read_logged_ping(log, start, end):
+    return json.loads(log[start:end])["ping"]
+
+
+class Buckets:
+    """Ping stores by bucket name, created on first use.
 
+    Buckets let a single server collect the pings of many browsers at once,
+    each pointed at its own ``/b/<bucket>/`` prefix. With ``log_dir`` set each
+    bucket logs its pings to ``<log_dir>/<bucket>.jsonl``.
 
-@app.route("/pings", methods=["GET", "DELETE"])
-def pings():
+    Dropped bucket names are remembered, so a ping a browser sends after its
+    test ended is rejected instead of creating the bucket again.
+    """
+
+    def __init__(self, log_dir=None, read_only=False):
+        self.log_dir = log_dir
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._stores = {}
+        self._dropped = set()
+
+    def get(self, name):
+        with self._lock:
+            if (store := self._stores.get(name)) is None:
+                if self.read_only:
+                    abort(404, f"Unknown bucket {name}")
+                if name in self._dropped:
+                    abort(410, f"Bucket {name} was dropped")
+                if not BUCKET_NAME.fullmatch(name):
+                    abort(400, f"Invalid bucket name {name}")
+                store = self._stores[name] = self._create(name)
+            return store
+
+    def add(self, name, store):
+        with self._lock:
+            self._stores[name] = store
+
+    def drop(self, name):
+        with self._lock:
+            store = self._stores.pop(name, None)
+            if store is not None and name != DEFAULT_BUCKET:
+                self._dropped.add(name)
+        if store is not None and store.log is not None:
+            store.log.close()
+        return store is not None
+
+    def _create(self, name):
+        log = None
+        if self.log_dir:
+            log = PingLog(os.path.join(self.log_dir, f"{name}.jsonl"))
+        return PingStore(max_pings=MAX_PINGS, max_bytes=MAX_BYTES, max_age=MAX_AGE, log=log)
+
+
+BUCKETS = Buckets()
+pings_api = Blueprint("pings_api", __name__)
+
+
+def query_filters():
+    filters = {key: request.args.get(key) for key in INDEXED_FIELDS}
+    filters["since"] = request.args.get("after", request.args.get("since", 0), type=int)
+    return filters
+
+
+def pings_response(records, cursor, summary=False):
+    """Serialize records, wrapped with the next cursor when ``after`` was requested.
+
+    Records are serialized as summaries when ``summary`` is set or requested.
+    """
+    if summary or request.args.get("summary"):
+        pings = [record.summary() for record in records]
+    else:
+        pings = [record.ping for record in records]
+    if "after" in request.args:
+        return jsonify({"pings": pings, "cursor": cursor})
+    return jsonify(pings)
+
+
+@pings_api.route("/pings", methods=["GET", "DELETE"])
+def pings(bucket):
+    """Return stored pings, optionally filtered.
+
+    ``?after=<cursor>`` returns ``{"pings": [...], "cursor": <cursor>}`` with only
+    the pings received after the cursor; pass the returned cursor back on the
+    next call to fetch incrementally.
+    """
+    store = BUCKETS.get(bucket)
     if request.method == "GET":
-        return jsonify(PINGS)
+        return pings_response(*store.query(**query_filters()))
 
     if request.method == "DELETE":
-        PINGS.clear()
+        if store.read_only:
+            abort(405, "Replayed pings are read only")
+        store.clear()
         return ""
 
 
-@app.route(
+@pings_api.route("/pings/summary", methods=["GET"])
+def pings_summary(bucket):
+    """Like ``GET /pings`` but returns compact summaries of each ping.
+
+    A summary holds the sequence number, namespace, document type,
+    experiments, Nimbus events and session information of a ping. The full
+    ping is available from ``GET /pings/<seq>``.
+    """
+    return pings_response(*BUCKETS.get(bucket).query(**query_filters()), summary=True)
+
+
+@pings_api.route("/pings/<int:seq>", methods=["GET"])
+def ping_by_seq(bucket, seq):
+    if (record := BUCKETS.get(bucket).get(seq)) is None:
+        abort(404)
+    return jsonify(record.ping)
+
+
+@pings_api.route("/pings/wait", methods=["GET"])
+def wait_for_pings(bucket):
+    """Long poll until a matching ping arrives.
+
+    Takes the same filters as ``GET /pings`` plus ``event``, a comma separated
+    list of Nimbus event names (e.g. ``enrollment``) that must appear in the
+    ping for the requested experiment and branch. Returns the matching pings
+    (or their summaries with ``summary=1``), or no pings once ``timeout``
+    seconds have passed without a match.
+    """
+    store = BUCKETS.get(bucket)
+    filters = query_filters()
+    if event := request.args.get("event"):
+        filters["event"] = set(event.split(","))
+    timeout = min(request.args.get("timeout", default=30, type=float), MAX_WAIT_TIMEOUT)
+    return pings_response(*store.wait(timeout, **filters))
+
+
+@pings_api.route(
     "/submit/<path:telemetry>",
     methods=["POST"],
 )
-def submit(telemetry):
-    if request.method == "POST":
-        request_data = request.get_data()
-
-        if request.headers.get("Content-Encoding") == "gzip":
-            request_data = zlib.decompress(request_data, zlib.MAX_WBITS | 16)
+def submit(bucket, telemetry):
 
+    if request.method == "POST":
+        store = BUCKETS.get(bucket)
+        if store.read_only:
+            abort(405, "Replayed pings are read only")
+        request_data = read_ping_body(store)
         ping_data = json.loads(request_data)
 
-        # Store JSON data to self.pings to be used by wait_for_pings()
-        PINGS.append(ping_data)
+        store.add(telemetry, ping_data, size=len(request_data))
         return ""
     return ""
 
 
+def read_ping_body(store):
+    """Read the request body in chunks, inflating gzip bodies as they stream in.
+
+    Aborts with 413 once the decompressed size passes ``MAX_PING_BYTES``.
+    """
+    decompressor = None
+    if request.headers.get("Content-Encoding") == "gzip":
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    body = bytearray()
+
+    def append(data):
+        body.extend(data)
+        if MAX_PING_BYTES and len(body) > MAX_PING_BYTES:
+            store.reject()
+            abort(413, f"Ping is larger than {MAX_PING_BYTES} bytes")
+
+    while chunk := request.stream.read(CHUNK_SIZE):
+        if decompressor is None:
+            append(chunk)
+            continue
+        while chunk:
+            # Cap each step so a tiny compressed body can't inflate past the limit at once.
+            limit = MAX_PING_BYTES - len(body) + 1 if MAX_PING_BYTES else 0
+            append(decompressor.decompress(chunk, limit))
+            chunk = decompressor.unconsumed_tail
+    if decompressor is not None:
+        append(decompressor.flush())
+    return bytes(body)
+
+
+@pings_api.route("/stats", methods=["GET"])
+def stats(bucket):
+    """Report stored ping counts, memory use and evictions."""
+    data = BUCKETS.get(bucket).stats()
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        data["max_rss_bytes"] = max_rss * 1024 if sys.platform != "darwin" else max_rss
+    return jsonify(data)
+
+
+@app.route("/b/<bucket>", methods=["DELETE"])
+def drop_bucket(bucket):
+    """Drop a bucket and all of its pings."""
+    if BUCKETS.read_only:
+        abort(405, "Replayed pings are read only")
+    if not BUCKETS.drop(bucket):
+        abort(404)
+    return ""
+
+
+app.register_blueprint(pings_api, url_defaults={"bucket": DEFAULT_BUCKET})
+app.register_blueprint(pings_api, url_prefix="/b/<bucket>", name="bucket_api")
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server handling requests on a fixed size thread pool.
+
+    The ping store lives in memory, so the server scales with threads rather
+    than processes. Each open ``/pings/wait`` long poll holds a thread.
+    """
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="ping_server")
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Collects telemetry pings sent by Firefox.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.environ.get("PING_SERVER_THREADS", 32)),
+        help="Number of request handler threads",
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        default=bool(os.environ.get("PING_SERVER_DEBUG")),
+        help="Run the Flask development server with the debugger and reloader",
+    )
+    parser.add_argument(
+        "--log-file",
+        default=os.environ.get("PING_SERVER_LOG"),
+        help="Append every received ping to this JSON lines file",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default=os.environ.get("PING_SERVER_LOG_DIR"),
+        help="Write the pings of every bucket to <log-dir>/<bucket>.jsonl",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="LOG_FILE",
+        help="Serve the pings of a log written with --log-file, read only",
+    )
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    app.run(debug=True, host="0.0.0.0", port=port)
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.replay:
+        store = PingStore(read_only=True)
+        replay_log(args.replay, store)
+        BUCKETS.read_only = True
+        BUCKETS.add(DEFAULT_BUCKET, store)
+        logging.info(f"Replaying {store.stats()['pings']} pings from {args.replay}")
+    else:
+        if args.log_file:
+            BUCKETS.get(DEFAULT_BUCKET).log = PingLog(args.log_file)
+        if args.log_dir:
+            os.makedirs(args.log_dir, exist_ok=True)
+            BUCKETS.log_dir = args.log_dir
+    if args.debug:
+        app.run(debug=True, host=args.host, port=args.port)
+    else:
+        server = PooledWSGIServer(args.host, args.port, app, threads=args.threads)
+        logging.info(f"ping_server listening on {args.host}:{server.port}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
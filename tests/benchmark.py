@@ -0,0 +1,234 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Startup benchmark comparing the branches of an experiment."""
+
+import logging
+import math
+import shutil
+import statistics
+import typing
+from pathlib import Path
+
+from tests.profiles import clone_tree
+from tests.results import update_json
+
+STARTUP_SCRIPT = """
+    const callback = arguments[arguments.length - 1];
+
+    (async function () {
+        const deadline = Date.now() + 30000;
+        let info = Services.startup.getStartupInfo();
+        while (!info.sessionRestored && Date.now() < deadline) {
+            await new Promise(resolve => setTimeout(resolve, 50));
+            info = Services.startup.getStartupInfo();
+        }
+        const result = {};
+        for (const [name, date] of Object.entries(info)) {
+            if (date && name != "process") {
+                result[name] = date.getTime() - info.process.getTime();
+            }
+        }
+        try {
+            const procs = await ChromeUtils.requestProcInfo();
+            result.memory = procs.memory + procs.children.reduce((sum, c) => sum + c.memory, 0);
+        } catch (err) {}
+        callback(result);
+    })();
+"""
+
+# Also used by the scenarios, to enroll in --experiment-branch.
+ENROLL_SCRIPT = """
+    const [recipe, branchSlug, callback] = arguments;
+
+    (async function () {
+        try {
+            const { ExperimentAPI } = ChromeUtils.importESModule(
+                "resource://nimbus/ExperimentAPI.sys.mjs"
+            );
+
+            Services.fog.initializeFOG();
+
+            await ExperimentAPI.ready();
+
+            ExperimentAPI.manager.store._deleteForTests(`optin-${recipe.slug}`);
+            const branch = recipe.branches.find(b => b.slug == branchSlug);
+            if (!branch) {
+                throw new Error(`Branch ${branchSlug} is not in the recipe of ${recipe.slug}`);
+            }
+            await ExperimentAPI.manager.forceEnroll(recipe, branch);
+            callback(true);
+        } catch (err) {
+            callback({ success: false, error: err.message });
+        }
+    })();
+"""
+ENROLLED_SCRIPT = """
+    const [slug, callback] = arguments;
+
+    (async function () {
+        const { ExperimentAPI } = ChromeUtils.importESModule(
+            "resource://nimbus/ExperimentAPI.sys.mjs"
+        );
+        await ExperimentAPI.ready();
+        callback(Boolean(ExperimentAPI.manager.store.get(slug)?.active));
+    })();
+"""
+
+# Metrics a verdict is based on, the others are only recorded.
+VERDICT_METRICS = ["main", "firstPaint", "sessionRestored", "memory"]
+
+
+def mann_whitney_u(first: list[float], second: list[float]) -> tuple[float, float]:
+    """Mann-Whitney U of ``first`` against ``second`` and its two sided p-value.
+
+    Uses the normal approximation with a tie correction, which is good enough
+    from about 8 samples per side.
+    """
+    n1, n2 = len(first), len(second)
+    values = sorted([(value, 0) for value in first] + [(value, 1) for value in second])
+    ranks = [0.0] * len(values)
+    ties = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        ties += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2) / math.sqrt(variance)
+    return u, math.erfc(abs(z) / math.sqrt(2))
+
+
+def compare(
+    control: dict[str, list[float]],
+    treatment: dict[str, list[float]],
+    alpha: float,
+    margin: float,
+) -> dict[str, dict]:
+    """Per metric comparison of treatment against control samples.
+
+    A metric regresses when treatment is significantly different at ``alpha``
+    and its median is more than ``margin`` above the control median.
+    """
+    result = {}
+    for metric in VERDICT_METRICS:
+        if not control.get(metric) or not treatment.get(metric):
+            continue
+        u, p_value = mann_whitney_u(treatment[metric], control[metric])
+        control_median = statistics.median(control[metric])
+        treatment_median = statistics.median(treatment[metric])
+        result[metric] = {
+            "control_median": control_median,
+            "treatment_median": treatment_median,
+            "u": u,
+            "p_value": p_value,
+            "regression": p_value < alpha and treatment_median > control_median * (1 + margin),
+        }
+    return result
+
+
+class StartupBenchmark(object):
+    """Cold and warm launches of an enrolled profile.
+
+    A seed profile is enrolled in the benchmarked branch once. Every cold
+    launch starts from a fresh copy of it without its startup cache, the warm
+    launch that follows reuses that copy. The OS file cache is not dropped,
+    which would need root.
+    """
+
+    def __init__(
+        self,
+        launch: typing.Callable[[Path], typing.Any],
+        workdir: Path,
+    ) -> None:
+        self.launch = launch
+        self.workdir = Path(workdir)
+
+    def run(
+        self, template: Path, recipe: dict, branch: str, launches: int
+    ) -> dict[str, dict[str, list]]:
+        # forceEnroll stores the recipe under the opt-in slug.
+        slug = f"optin-{recipe['slug']}"
+        seed = clone_tree(template, self.workdir / "seed")
+        driver = self.launch(seed)
+        try:
+            with driver.context(driver.CONTEXT_CHROME):
+                result = driver.execute_async_script(ENROLL_SCRIPT, recipe, branch)
+                if result is not True:
+                    raise AssertionError(f"Force enrollment failed: {result}")
+                if not driver.execute_async_script(ENROLLED_SCRIPT, slug):
+                    raise AssertionError(f"{slug} is not active in the benchmark profile")
+        finally:
+            driver.quit()
+
+        samples: dict[str, dict[str, list]] = {"cold": {}, "warm": {}}
+        for launch in range(launches):
+            profile = self.workdir / f"launch-{launch}"
+            clone_tree(seed, profile)
+            shutil.rmtree(profile / "startupCache", ignore_errors=True)
+            for kind in ("cold", "warm"):
+                measurement = self._measure(profile)
+                logging.info(f"Startup {kind} launch {launch}: {measurement}")
+                for metric, value in measurement.items():
+                    samples[kind].setdefault(metric, []).append(value)
+            shutil.rmtree(profile, ignore_errors=True)
+        shutil.rmtree(seed, ignore_errors=True)
+        return samples
+
+    def _measure(self, profile: Path) -> dict[str, float]:
+        driver = self.launch(profile)
+        try:
+            with driver.context(driver.CONTEXT_CHROME):
+                result = driver.execute_async_script(STARTUP_SCRIPT)
+            return {metric: float(value) for metric, value in result.items()}
+        finally:
+            driver.quit()
+
+
+def record(
+    path: Path,
+    branch: str,
+    control_branch: str,
+    samples: dict[str, dict[str, list]],
+    alpha: float,
+    margin: float,
+) -> dict:
+    """Store the samples of ``branch`` and compare every branch to control.
+
+    Each branch is usually benchmarked by its own test run, so the results
+    file keeps the samples of earlier runs.
+    """
+    with update_json(path, {"branches": {}}) as results:
+        results["branches"][branch] = samples
+        results["control"] = control_branch
+        results["verdict"] = {}
+        control = results["branches"].get(control_branch)
+        for name, treatment in results["branches"].items():
+            if control is None or name == control_branch:
+                continue
+            comparison = {
+                kind: compare(control[kind], treatment[kind], alpha, margin)
+                for kind in ("cold", "warm")
+            }
+            regressions = [
+                f"{kind} {metric}"
+                for kind, metrics in comparison.items()
+                for metric, values in metrics.items()
+                if values["regression"]
+            ]
+            results["verdict"][name] = {
+                "result": "slower" if regressions else "ok",
+                "regressions": regressions,
+                "metrics": comparison,
+            }
+    return results
@@ -0,0 +1,132 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Pool of warm Firefox sessions shared between tests."""
+
+import logging
+import typing
+from dataclasses import dataclass
+
+from selenium.common.exceptions import WebDriverException
+
+from tests.prefs import PREFERENCES
+
+RESET_SCRIPT = """
+    const [server, gleanPort] = arguments;
+    const { TelemetrySend } = ChromeUtils.importESModule(
+        "resource://gre/modules/TelemetrySend.sys.mjs"
+    );
+
+    // Glean only reads its upload endpoint when it is initialized, so set it
+    // before testResetFOG re-initializes Glean and drops its pending pings.
+    Services.prefs.setIntPref("telemetry.fog.test.localhost_port", gleanPort);
+    Services.fog.testResetFOG();
+    Services.telemetry.clearScalars();
+    Services.telemetry.clearEvents();
+    Services.prefs.setStringPref("toolkit.telemetry.server", server);
+    TelemetrySend.setServer(server);
+"""
+
+# Undoes what the search tests change in the browser.
+CLEANUP_SCRIPT = """
+    const callback = arguments[arguments.length - 1];
+
+    (async function () {
+        try {
+            let CustomizableUI;
+            try {
+                ({ CustomizableUI } = ChromeUtils.importESModule(
+                    "resource:///modules/CustomizableUI.sys.mjs"
+                ));
+            } catch (e) {
+                ({ CustomizableUI } = ChromeUtils.importESModule(
+                    "moz-src:///browser/components/customizableui/CustomizableUI.sys.mjs"
+                ));
+            }
+            const engine = Services.search.getEngineByName("Moz Search");
+            if (engine) {
+                await Services.search.removeEngine(engine);
+            }
+            CustomizableUI.reset();
+            Services.prefs.clearUserPref("browser.search.widget.inNavBar");
+            callback(true);
+        } catch (err) {
+            callback(err.message);
+        }
+    })();
+"""
+
+
+@dataclass
+class PooledBrowser:
+    """A pooled WebDriver session and whether it was enrolled already."""
+
+    driver: typing.Any
+    enrolled: bool = False
+
+
+class BrowserPool(object):
+    """Keeps one running browser per experiment and branch.
+
+    A browser is handed to the next test after closing its extra windows,
+    removing the search engine and toolbar changes of the search tests,
+    resetting FOG and legacy telemetry, and pointing telemetry at the new
+    test's ping server. FOG is re-initialized with the Glean upload endpoint
+    of the prefs, so no Glean ping of the previous test is uploaded later.
+    Browsers that were quit by a test are relaunched. Tests that leave other
+    state behind, such as an unenrollment, are marked ``fresh_browser`` and
+    never get a pooled browser.
+    """
+
+    def __init__(self) -> None:
+        self._browsers: dict[tuple, PooledBrowser] = {}
+
+    def acquire(self, key: tuple, launch: typing.Callable, ping_server: str) -> PooledBrowser:
+        browser = self._browsers.get(key)
+        if browser is None or not self._is_alive(browser.driver):
+            logging.info(f"Launching pooled browser for {key}")
+            browser = self._browsers[key] = PooledBrowser(launch())
+        else:
+            logging.info(f"Reusing pooled browser for {key}")
+            self._reset(browser.driver)
+        with browser.driver.context(browser.driver.CONTEXT_CHROME):
+            browser.driver.execute_script(
+                RESET_SCRIPT, ping_server, PREFERENCES["telemetry.fog.test.localhost_port"]
+            )
+        return browser
+
+    def find(self, driver: typing.Any) -> PooledBrowser | None:
+        return next((item for item in self._browsers.values() if item.driver is driver), None)
+
+    def quit_all(self) -> None:
+        for browser in self._browsers.values():
+            try:
+                browser.driver.quit()
+            except WebDriverException:
+                pass
+        self._browsers.clear()
+
+    @staticmethod
+    def _is_alive(driver: typing.Any) -> bool:
+        try:
+            driver.window_handles
+        except WebDriverException:
+            return False
+        return driver.session_id is not None
+
+    @staticmethod
+    def _reset(driver: typing.Any) -> None:
+        """Close every window but the first one in both contexts and undo the
+        search tests' changes."""
+        for context in (driver.CONTEXT_CHROME, driver.CONTEXT_CONTENT):
+            with driver.context(context):
+                first, *others = driver.window_handles
+                for handle in others:
+                    driver.switch_to.window(handle)
+                    driver.close()
+                driver.switch_to.window(first)
+        driver.get("about:blank")
+        with driver.context(driver.CONTEXT_CHROME):
+            if (result := driver.execute_async_script(CLEANUP_SCRIPT)) is not True:
+                logging.warning(f"Failed to clean up pooled browser: {result}")
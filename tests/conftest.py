@@ -5,11 +5,14 @@
 import json
 import logging
 import os
-import shutil
+import re
+import socket
 import subprocess
 import sys
+import tempfile
 import time
 import typing
+import uuid
 from pathlib import Path
 
 import pytest
@@ -17,11 +20,28 @@ import requests
 from pytest_bdd import given, then
 from pytest_metadata.plugin import metadata_key
 from requests.exceptions import ConnectionError, Timeout
-from selenium.common.exceptions import JavascriptException
+from selenium import webdriver
+from selenium.common.exceptions import JavascriptException, WebDriverException
 from selenium.webdriver import ActionChains, Keys
 from selenium.webdriver.common.by import By
+from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+
+from tests.benchmark import ENROLL_SCRIPT, ENROLLED_SCRIPT, StartupBenchmark, record
+from tests.browser_pool import BrowserPool
+from tests.footprint import PROC_INFO_SCRIPT, FootprintSampler
+from tests.footprint import record as record_footprint
+from tests.footprint import supported as footprint_supported
+from tests.prefs import PREFERENCES, build_user_js
+from tests.profiles import ProfileCache, ProfileReaper, firefox_version
+from tests.telemetry import (
+    TelemetrySnapshots,
+    has_impression,
+    has_keyed_scalar,
+    has_nimbus_event,
+    poll_snapshot,
+)
+from tests.timings import TimedWait, TimingsPlugin, phase, sleep
 
 
 def pytest_addoption(parser) -> None:
@@ -73,28 +93,124 @@ def pytest_addoption(parser) -> None:
         action="store",
         default=None,
         help="The path to the Firefox you want to use",
+    ),
+    parser.addoption(
+        "--ping-log-dir",
+        action="store",
+        default="tests/ping_logs",
+        help="Directory the ping server writes a ping log per test to",
+    ),
+    parser.addoption(
+        "--ping-server-url",
+        action="store",
+        default=None,
+        help="Use an already running ping server instead of starting one",
+    ),
+    parser.addoption(
+        "--reuse-browser",
+        action="store_true",
+        default=None,
+        help="Reuse one enrolled browser across tests instead of launching one per test",
+    )
+    parser.addoption(
+        "--timings-json",
+        action="store",
+        default=None,
+        help="Record where each test spends its time and write the breakdown to this file",
+    )
+    parser.addoption(
+        "--startup-benchmark",
+        action="store",
+        type=int,
+        default=0,
+        help="Benchmark startup with this many cold and warm launches",
+    )
+    parser.addoption(
+        "--startup-benchmark-dir",
+        action="store",
+        default="tests/benchmarks",
+        help="Where startup benchmark results are kept, one file per experiment",
+    )
+    parser.addoption(
+        "--startup-benchmark-margin",
+        action="store",
+        type=float,
+        default=0.05,
+        help="Slowdown over the control branch tolerated by the startup benchmark",
+    )
+    parser.addoption(
+        "--footprint",
+        action="store_true",
+        default=None,
+        help="Sample the memory and CPU use of Firefox during each test",
+    )
+    parser.addoption(
+        "--footprint-dir",
+        action="store",
+        default="tests/footprint",
+        help="Where footprint samples are kept, one file per experiment",
+    )
+    parser.addoption(
+        "--footprint-threshold",
+        action="store",
+        type=float,
+        default=0.2,
+        help="Growth over the control branch tolerated by the footprint check",
     )
 
 
-def start_process(path, command):
+def pytest_configure(config):
+    if config.getoption("--timings-json"):
+        config.pluginmanager.register(TimingsPlugin(config), "klaatu-timings")
+
+
+FIREFOX_VERSION = pytest.StashKey[str]()
+
+
+def free_port(host="localhost"):
+    """A port nothing listens on right now, so parallel workers don't collide."""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_process(path, command, port, host="localhost", timeout=30):
+    """Start a server and return once it accepts connections on ``port``.
+
+    The port is probed with an exponential backoff. Output is written to a log
+    file instead of a pipe nobody drains, which could otherwise block the child.
+    """
     module_path = Path(path)
+    log_path = Path(tempfile.gettempdir()) / f"klaatu-{module_path.name}-{port}.log"
 
-    try:
+    with open(log_path, "w") as log:
         process = subprocess.Popen(
             command,
-            encoding="utf-8",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
+            stdout=log,
+            stderr=subprocess.STDOUT,
             cwd=module_path.absolute(),
         )
-        stdout, stderr = process.communicate(timeout=5)
+    deadline = time.time() + timeout
+    delay = 0.05
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(
+                f"{module_path.name} exited with {process.returncode}: {log_path.read_text()}"
+            )
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                logging.info(f"{module_path.name} server started, logging to {log_path}")
+                return process
+        except OSError:
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+    process.kill()
+    raise Exception(f"{module_path.name} did not listen on port {port} within {timeout} seconds")
 
-        if process.returncode != 0:
-            raise Exception(stderr)
-    except subprocess.TimeoutExpired:
-        logging.info(f"{module_path.name} server started")
-        return process
+
+def node_file_name(node):
+    """A file name unique to a test node."""
+    return re.sub(r"[^\w.-]+", "_", node.nodeid)
 
 
 @pytest.fixture(name="experiment_json", scope="session")
@@ -123,94 +239,190 @@ def fixture_experiment_json(request):
 def fixture_enroll_experiment(
     request: typing.Any,
     selenium: typing.Any,
-    telemetry_event_check: object,
+    browser_pool: typing.Any,
+    wait_for_enrollment: typing.Any,
     experiment_json: object,
     experiment_slug: str,
 ) -> typing.Any:
     """Fixture to enroll into an experiment"""
     experiment_branch = request.config.getoption("--experiment-branch")
-    control = False
-    timeout = time.time() + 60
+    pooled_browser = browser_pool.find(selenium)
 
     if experiment_branch == "":
         pytest.raises("The experiment branch must be declared")
-    script = """
-        const callback = arguments[arguments.length - 1];
-
-        (async function (arguments) {
-            try {
-                const { ExperimentAPI } = ChromeUtils.importESModule(
-                    "resource://nimbus/ExperimentAPI.sys.mjs"
-                );
-                const branchSlug = arguments[1];
-
-                Services.fog.initializeFOG();
-
-                await ExperimentAPI.ready();
-
-                ExperimentAPI.manager.store._deleteForTests(arguments[1]);
-                const recipe = arguments[0];
-                let branch = recipe.branches.find(b => b.slug == "control");
-                await ExperimentAPI.manager.forceEnroll(recipe, branch);
-
-                callback(true);
-            } catch (err) {
-                callback({ success: false, error: err.message });
-            }
-        })(arguments);
-    """
-
+    if pooled_browser and pooled_browser.enrolled:
+        with selenium.context(selenium.CONTEXT_CHROME):
+            active = selenium.execute_async_script(ENROLLED_SCRIPT, f"optin-{experiment_slug}")
+        if active:
+            logging.info("Pooled browser is already enrolled")
+            return
+        logging.info("Pooled browser is not enrolled anymore, enrolling it again")
+        pooled_browser.enrolled = False
     try:
         with selenium.context(selenium.CONTEXT_CHROME):
-            time.sleep(5)
-            result = selenium.execute_async_script(script, experiment_json, experiment_branch)
+            result = selenium.execute_async_script(
+                ENROLL_SCRIPT, experiment_json, experiment_branch
+            )
             logging.info(f"Force Enrolling: {result}")
     except JavascriptException as e:
         if "slug" in str(e):
             raise (Exception("Experiment slug was not found in the experiment."))
-    while not control:
-        time.sleep(10)
-        control = telemetry_event_check(f"optin-{experiment_slug}", "enrollment")
-        if time.time() > timeout:
-            raise AssertionError("Experiment enrollment was never seen in ping Data")
+    else:
+        if result is not True:
+            raise AssertionError(f"Force enrollment failed: {result}")
+    if not wait_for_enrollment(f"optin-{experiment_slug}"):
+        raise AssertionError("Experiment enrollment was never seen in ping Data")
     logging.info("Experiment loaded successfully!")
-    time.sleep(15)
+    if pooled_browser:
+        pooled_browser.enrolled = True
+
+
+@pytest.fixture(name="footprint", autouse=True)
+def fixture_footprint(
+    request: typing.Any,
+    selenium: typing.Any,
+    enroll_experiment: typing.Any,
+    experiment_json: typing.Any,
+    experiment_slug: str,
+    experiment_branch: str,
+) -> typing.Any:
+    """Sample Firefox's process tree while the test runs, with --footprint.
+
+    The summary is stored per experiment, branch and test, and compared to the
+    control branch's summary for the same test when there is one.
+    """
+    if not request.config.getoption("--footprint"):
+        yield None
+        return
+    if not footprint_supported():
+        logging.warning("Footprint sampling needs psutil or /proc, not sampling this test")
+        yield None
+        return
+    sampler = FootprintSampler(selenium.capabilities["moz:processID"]).start()
+    yield sampler
+
+    summary = sampler.stop()
+    try:
+        with selenium.context(selenium.CONTEXT_CHROME):
+            summary["proc_info"] = selenium.execute_async_script(PROC_INFO_SCRIPT)
+    except WebDriverException:
+        logging.info("Browser is gone, no process info for the footprint")
+    request.node.user_properties.append(("footprint", summary))
+    regressions = record_footprint(
+        Path(request.config.getoption("--footprint-dir")) / f"{experiment_slug}.json",
+        experiment_branch,
+        experiment_json.get("referenceBranch") or "control",
+        request.node.nodeid,
+        summary,
+        request.config.getoption("--footprint-threshold"),
+    )
+    if regressions:
+        pytest.fail(f"Footprint grew over the control branch: {', '.join(regressions)}")
+
+
+@pytest.fixture(name="wait_for_enrollment")
+def fixture_wait_for_enrollment(selenium):
+    def _wait_for_enrollment(slug, timeout=50):
+        """Wait in chrome context for the Nimbus enrollment event of ``slug``.
+
+        The script resolves as soon as the experiment store reports an update
+        for the slug and Glean has recorded the enrollment event, so there is
+        no WebDriver round trip per check. ``timeout`` must stay below the
+        script timeout set on the selenium fixture.
+        """
+        script = """
+            const [slug, timeout] = arguments;
+            const callback = arguments[arguments.length - 1];
+
+            (async function () {
+                try {
+                    const { ExperimentAPI } = ChromeUtils.importESModule(
+                        "resource://nimbus/ExperimentAPI.sys.mjs"
+                    );
+                    await ExperimentAPI.ready();
+                    const store = ExperimentAPI.manager.store;
+                    const enrolled = () =>
+                        (Glean.nimbusEvents.enrollment.testGetValue("events") ?? []).some(
+                            event => event.extra?.experiment == slug
+                        );
+
+                    let poll, deadline;
+                    const check = () => {
+                        if (enrolled()) {
+                            done(true);
+                        }
+                    };
+                    const done = result => {
+                        store.off(`update:${slug}`, check);
+                        clearInterval(poll);
+                        clearTimeout(deadline);
+                        callback(result);
+                    };
+                    // The Glean event can be recorded just after the store update,
+                    // so also check on a short in-browser interval.
+                    store.on(`update:${slug}`, check);
+                    poll = setInterval(check, 250);
+                    deadline = setTimeout(() => done(enrolled()), timeout);
+                    check();
+                } catch (err) {
+                    callback(false);
+                }
+            })();
+        """
+        start = time.time()
+        with phase("enrollment"):
+            with selenium.context(selenium.CONTEXT_CHROME):
+                enrolled = selenium.execute_async_script(script, slug, timeout * 1000)
+        logging.info(f"Enrollment of {slug} seen: {enrolled} after {time.time() - start:.2f}s")
+        return enrolled
+
+    return _wait_for_enrollment
 
 
 @pytest.fixture(name="experiment_slug", scope="session", autouse=True)
 def fixture_experiment_slug(request) -> typing.Any:
-    slug = request.config.getoption("--experiment-slug")
-    os.environ["EXPERIMENT_SLUG"] = slug
-    return slug
+    return request.config.getoption("--experiment-slug")
 
 
 @pytest.fixture(name="experiment_branch", scope="session", autouse=True)
 def fixture_experiment_branch(request):
-    branch = request.config.getoption("--experiment-branch")
-    os.environ["EXPERIMENT_BRANCH"] = branch
-    return branch
+    return request.config.getoption("--experiment-branch")
+
+
+@pytest.fixture(name="profile_cache", scope="session")
+def fixture_profile_cache() -> ProfileCache:
+    return ProfileCache(Path("utilities/profile-templates"))
+
+
+@pytest.fixture(name="profile_reaper", scope="session")
+def fixture_profile_reaper():
+    reaper = ProfileReaper()
+    yield reaper
+    reaper.close()
 
 
 @pytest.fixture
-def setup_profile(pytestconfig: typing.Any, request: typing.Any) -> typing.Any:
+def setup_profile(
+    pytestconfig: typing.Any, request: typing.Any, profile_cache: ProfileCache
+) -> typing.Any:
     """Fixture to create a copy of the profile to use within the test."""
     if request.config.getoption("--run-update-test"):
-        shutil.copytree(
-            Path("utilities/klaatu-profile-old-base").absolute(),
-            Path("utilities/klaatu-profile").absolute(),
-            dirs_exist_ok=True,
-            ignore_dangling_symlinks=True,
-        )
-        return f'{Path("utilities/klaatu-profile").absolute()}'
-    if request.node.get_closest_marker("reuse_profile") and not request.config.getoption(
-        "--run-update-test"
-    ):
-        shutil.copytree(
-            Path("utilities/klaatu-profile-firefox-base").absolute(),
-            Path("utilities/klaatu-profile-current-base").absolute(),
-            dirs_exist_ok=True,
-        )
-        return f'{Path("utilities/klaatu-profile-current-base").absolute()}'
+        base = Path("utilities/klaatu-profile-old-base")
+        binary = f"{Path('utilities/firefox-old-nightly/firefox/firefox-bin').absolute()}"
+        destination = Path("utilities/klaatu-profile").absolute()
+    elif request.node.get_closest_marker("reuse_profile"):
+        base = Path("utilities/klaatu-profile-firefox-base")
+        binary = request.config.getoption("--firefox-path")
+    else:
+        base = None
+        binary = request.config.getoption("--firefox-path")
+    if not request.config.getoption("--run-update-test"):
+        destination = Path(
+            f"utilities/klaatu-profiles/{node_file_name(request.node)}-{uuid.uuid4().hex[:8]}"
+        ).absolute()
+    prefs = build_user_js(profile_cache.root)
+    template = profile_cache.template(base, firefox_version(binary), prefs)
+    return f"{profile_cache.clone(template, destination)}"
 
 
 @pytest.fixture
@@ -220,6 +432,7 @@ def firefox_options(
     firefox_options: typing.Any,
     request: typing.Any,
     ping_server,
+    profile_reaper: ProfileReaper,
 ) -> typing.Any:
     """Setup Firefox"""
     if firefox_path := request.config.getoption("--firefox-path"):
@@ -236,75 +449,78 @@ def firefox_options(
             firefox_options.add_argument(
                 f'{Path("utilities/klaatu-profile-disable-test").absolute()}'
             )
+            # That profile is not built from a template, so it has no baked user.js.
+            for name, value in PREFERENCES.items():
+                firefox_options.set_preference(name, value)
         firefox_options.add_argument("-profile")
         firefox_options.add_argument(setup_profile)
-    if request.node.get_closest_marker("reuse_profile") and not request.config.getoption(
-        "--run-update-test"
-    ):
+    else:
         firefox_options.add_argument("-profile")
         firefox_options.add_argument(setup_profile)
     firefox_options.add_argument("-remote-allow-system-access")
-    firefox_options.set_preference("extensions.install.requireBuiltInCerts", False)
-    firefox_options.log.level = "trace"
-    firefox_options.set_preference("browser.cache.disk.smart_size.enabled", False)
+    # Everything else comes from the user.js baked into the profile template.
     firefox_options.set_preference("toolkit.telemetry.server", f"{ping_server}")
-    firefox_options.set_preference("telemetry.fog.test.localhost_port", -1)
-    firefox_options.set_preference("toolkit.telemetry.initDelay", 1)
-    firefox_options.set_preference("ui.popup.disable_autohide", True)
-    firefox_options.set_preference("toolkit.telemetry.minSubsessionLength", 0)
-    firefox_options.set_preference("datareporting.healthreport.uploadEnabled", True)
-    firefox_options.set_preference("datareporting.policy.dataSubmissionEnabled", True)
-    firefox_options.set_preference(
-        "datareporting.policy.dataSubmissionPolicyBypassNotification", False
-    )
-    firefox_options.set_preference("sticky.targeting.test.pref", True)
-    firefox_options.set_preference("toolkit.telemetry.log.level", "Trace")
-    firefox_options.set_preference("toolkit.telemetry.log.dump", True)
-    firefox_options.set_preference("toolkit.telemetry.send.overrideOfficialCheck", True)
-    firefox_options.set_preference("toolkit.telemetry.testing.disableFuzzingDelay", True)
-    firefox_options.set_preference("nimbus.debug", True)
-    firefox_options.set_preference("app.normandy.run_interval_seconds", 30)
-    firefox_options.set_preference(
-        "security.content.signature.root_hash",
-        "5E:36:F2:14:DE:82:3F:8B:29:96:89:23:5F:03:41:AC:AF:A0:75:AF:82:CB:4C:D4:30:7C:3D:B3:43:39:2A:FE",  # noqa: E501
-    )
-    firefox_options.set_preference("datareporting.healthreport.service.enabled", True)
-    firefox_options.set_preference("datareporting.healthreport.logging.consoleEnabled", True)
-    firefox_options.set_preference("datareporting.healthreport.service.firstRun", True)
-    firefox_options.set_preference(
-        "datareporting.healthreport.documentServerURI",
-        "https://www.mozilla.org/legal/privacy/firefox.html#health-report",
-    )
-    firefox_options.set_preference(
-        "app.normandy.api_url", "https://normandy.cdn.mozilla.net/api/v1"
-    )
-    firefox_options.set_preference("app.normandy.user_id", "7ef5ab6d-42d6-4c4e-877d-c3174438050a")
-    firefox_options.set_preference("messaging-system.log", "debug")
-    firefox_options.set_preference("toolkit.telemetry.scheduler.tickInterval", 15)
-    firefox_options.set_preference("toolkit.telemetry.collectInterval", 10)
-    firefox_options.set_preference("toolkit.telemetry.eventping.minimumFrequency", 3000)
-    firefox_options.set_preference("toolkit.telemetry.unified", True)
-    firefox_options.set_preference("toolkit.telemetry.eventping.maximumFrequency", 6000)
-    firefox_options.set_preference("allowServerURLOverride", True)
-    firefox_options.set_preference("browser.aboutConfig.showWarning", False)
-    firefox_options.set_preference("browser.newtabpage.enabled", True)
-    firefox_options.set_preference("privacy.query_stripping.enabled", False)
-    firefox_options.set_preference("remote.system-access-check.enabled", False)
     yield firefox_options
 
-    # Delete old pings
-    try:
-        requests.delete(f"{ping_server}/pings", timeout=5)
-    except (Timeout, ConnectionError) as e:
-        logging.warning(f"Failed to delete pings from server: {e}")
+    # Remove old profile, pooled browsers keep theirs until the session ends
+    if use_browser_pool(request):
+        profile_reaper.defer(setup_profile)
+    else:
+        profile_reaper.reap(setup_profile)
 
-    # Remove old profile
-    if (
-        request.node.get_closest_marker("reuse_profile")
-        and not request.config.getoption("--run-update-test")
-        or request.config.getoption("--run-update-test")
-    ):
-        shutil.rmtree(setup_profile)
+
+@pytest.fixture(name="startup_benchmark")
+def fixture_startup_benchmark(
+    request: typing.Any,
+    firefox_options: typing.Any,
+    profile_cache: ProfileCache,
+    experiment_json: typing.Any,
+    experiment_slug: str,
+    experiment_branch: str,
+    tmp_path: Path,
+) -> typing.Any:
+    """Run the startup benchmark and return the results of the experiment.
+
+    Returns None unless --startup-benchmark is given.
+    """
+
+    def launch(profile):
+        options = Options()
+        options.binary_location = firefox_options.binary_location
+        arguments = iter(firefox_options.arguments)
+        for argument in arguments:
+            if argument == "-profile":
+                next(arguments)  # the test's own profile
+            else:
+                options.add_argument(argument)
+        options.add_argument("-profile")
+        options.add_argument(f"{profile}")
+        for name, value in firefox_options.preferences.items():
+            options.set_preference(name, value)
+        driver = webdriver.Firefox(options=options)
+        driver.set_script_timeout(60)
+        return driver
+
+    def _startup_benchmark():
+        if not (launches := request.config.getoption("--startup-benchmark")):
+            return None
+        binary = request.config.getoption("--firefox-path")
+        template = profile_cache.template(
+            None, firefox_version(binary), build_user_js(profile_cache.root)
+        )
+        samples = StartupBenchmark(launch, tmp_path).run(
+            template, experiment_json, experiment_branch, launches
+        )
+        return record(
+            Path(request.config.getoption("--startup-benchmark-dir")) / f"{experiment_slug}.json",
+            experiment_branch,
+            experiment_json.get("referenceBranch") or "control",
+            samples,
+            alpha=0.05,
+            margin=request.config.getoption("--startup-benchmark-margin"),
+        )
+
+    return _startup_benchmark
 
 
 @pytest.fixture
@@ -318,9 +534,46 @@ def firefox_startup_time(firefox: typing.Any) -> typing.Any:
     )
 
 
+@pytest.fixture(name="browser_pool", scope="session")
+def fixture_browser_pool(profile_reaper: ProfileReaper):
+    # Depends on the reaper so browsers quit before their profiles are deleted.
+    pool = BrowserPool()
+    yield pool
+    pool.quit_all()
+
+
+def use_browser_pool(request: typing.Any) -> bool:
+    """Whether a test can run in a pooled browser rather than a fresh one."""
+    return bool(
+        request.config.getoption("--reuse-browser")
+        and not request.config.getoption("--run-update-test")
+        and not request.node.get_closest_marker("reuse_profile")
+        and not request.node.get_closest_marker("update_test")
+        and not request.node.get_closest_marker("fresh_browser")
+    )
+
+
 @pytest.fixture
-def selenium(selenium: typing.Any) -> typing.Any:
+def selenium(
+    request: typing.Any,
+    browser_pool: typing.Any,
+    experiment_slug: str,
+    experiment_branch: str,
+    ping_server: str,
+) -> typing.Any:
     """Setup Selenium"""
+    if use_browser_pool(request):
+        browser = browser_pool.acquire(
+            (experiment_slug, experiment_branch),
+            lambda: request.getfixturevalue("driver_class")(
+                **request.getfixturevalue("driver_kwargs")
+            ),
+            ping_server,
+        )
+        selenium = browser.driver
+        request.node._driver = selenium  # used by pytest-selenium for failure reports
+    else:
+        selenium = request.getfixturevalue("driver")
     selenium.set_page_load_timeout(60)  # Timeout for page loads
     selenium.set_script_timeout(60)  # Timeout for async scripts
     return selenium
@@ -353,62 +606,81 @@ def trigger_experiment_loader(selenium):
                 })();
                 """
             selenium.execute_async_script(script)
-        time.sleep(5)
+        sleep(5)
 
     return _trigger_experiment_loader
 
 
+@pytest.fixture(name="wait_for_ping")
+def fixture_wait_for_ping(ping_server):
+    def _wait_for_ping(timeout=60, after=0, **predicate):
+        """Block on the ping server until a ping newer than the ``after`` cursor
+        matching ``predicate`` arrives. Returns the pings and the next cursor."""
+        with phase("ping polling"):
+            deadline = time.time() + timeout
+            while (remaining := deadline - time.time()) > 0:
+                params = {"timeout": min(remaining, 30), "after": after, **predicate}
+                try:
+                    data = requests.get(
+                        f"{ping_server}/pings/wait", params=params, timeout=params["timeout"] + 5
+                    ).json()
+                except (Timeout, ConnectionError):
+                    logging.warning("Failed to wait for pings from server, retrying...")
+                    sleep(1)
+                    continue
+                if data["pings"]:
+                    return data["pings"], data["cursor"]
+                after = data["cursor"]
+            return [], after
+
+    return _wait_for_ping
+
+
 @pytest.fixture(name="check_ping_for_experiment")
-def fixture_check_ping_for_experiment(trigger_experiment_loader, ping_server):
+def fixture_check_ping_for_experiment(trigger_experiment_loader, wait_for_ping):
     def _check_ping_for_experiment(experiment=None):
-        control = True
         timeout = time.time() + 60
-        while control and time.time() < timeout:
-            try:
-                data = requests.get(f"{ping_server}/pings", timeout=5).json()
-            except (Timeout, ConnectionError):
-                logging.warning("Failed to get pings from server, retrying...")
-                time.sleep(5)
-                continue
-            try:
-                experiments_data = [
-                    item["environment"]["experiments"]
-                    for item in data
-                    if "experiments" in item["environment"]
-                ]
-            except KeyError:
-                continue
-            else:
-                for item in experiments_data:
-                    if experiment in item:
-                        return item[experiment]
-                time.sleep(5)
-                trigger_experiment_loader()
+        cursor = 0
+        while time.time() < timeout:
+            data, cursor = wait_for_ping(
+                timeout=min(10, timeout - time.time()),
+                after=cursor,
+                namespace="telemetry",
+                experiment=experiment,
+            )
+            # Only the environment counts, not experiments seen in events such
+            # as an unenrollment.
+            experiments_data = [
+                item["environment"]["experiments"]
+                for item in data
+                if "experiments" in item.get("environment", {})
+            ]
+            for item in experiments_data:
+                if experiment in item:
+                    return item[experiment]
+            trigger_experiment_loader()
         else:
             return False
 
     return _check_ping_for_experiment
 
 
-@pytest.fixture(name="telemetry_event_check")
-def fixture_telemetry_event_check(trigger_experiment_loader, selenium):
-    def _telemetry_event_check(experiment=None, event=None):
-        nimbus_events = None
-        script = f"return Glean.nimbusEvents.{event}.testGetValue('events')"
+@pytest.fixture(name="telemetry_snapshot")
+def fixture_telemetry_snapshot(selenium):
+    """Cached snapshot of the browser's telemetry shared by the checks below."""
+    return TelemetrySnapshots(selenium)
 
-        try:
-            with selenium.context(selenium.CONTEXT_CHROME):
-                nimbus_events = selenium.execute_script(script)
 
-            logging.info(f"nimbus events: {nimbus_events}")
-            assert any(
-                events["name"] == event and events["extra"]["experiment"] == experiment
-                for events in nimbus_events
-            )
+@pytest.fixture(name="telemetry_event_check")
+def fixture_telemetry_event_check(trigger_experiment_loader, telemetry_snapshot):
+    def _telemetry_event_check(experiment=None, event=None):
+        snapshot = telemetry_snapshot.get(nimbus_events=[event])
+        logging.info(f"nimbus events: {snapshot['nimbusEvents'].get(event)}")
+        if has_nimbus_event(snapshot, event, experiment):
             return True
-        except (AssertionError, TypeError):
-            trigger_experiment_loader()
-            return False
+        trigger_experiment_loader()
+        telemetry_snapshot.invalidate()
+        return False
 
     return _telemetry_event_check
 
@@ -419,13 +691,13 @@ def fixture_cmd_or_ctrl_button():
 
 
 @pytest.fixture(name="navigate_using_url_bar")
-def fixture_navigate_using_url_bar(selenium, cmd_or_ctrl_button):
+def fixture_navigate_using_url_bar(selenium, cmd_or_ctrl_button, static_server):
     def _navigate_function(text=None, use_clipboard=False):
         if not text:
-            text = "http://localhost:8000"
+            text = static_server
         with selenium.context(selenium.CONTEXT_CHROME):
             el = selenium.find_element(By.CSS_SELECTOR, "#urlbar-input")
-            WebDriverWait(selenium, 60).until(EC.element_to_be_clickable(el))
+            TimedWait(selenium, 60).until(EC.element_to_be_clickable(el))
             if use_clipboard:
                 ActionChains(selenium).move_to_element(el).pause(1).click().pause(1).key_down(
                     cmd_or_ctrl_button
@@ -435,7 +707,7 @@ def fixture_navigate_using_url_bar(selenium, cmd_or_ctrl_button):
                 el.click()
                 el.send_keys(text)
                 el.send_keys(Keys.ENTER)
-        WebDriverWait(selenium, 60).until(
+        TimedWait(selenium, 60).until(
             EC.any_of(
                 EC.presence_of_element_located((By.CSS_SELECTOR, ".loaded")),
                 EC.title_contains(text),
@@ -448,61 +720,36 @@ def fixture_navigate_using_url_bar(selenium, cmd_or_ctrl_button):
 
 
 @pytest.fixture(name="find_impression")
-def fixture_find_impression(selenium, find_telemetry):
+def fixture_find_impression(selenium, telemetry_snapshot):
     def fixture_find_impression_runner(source: str, provider: str, tagged: bool) -> bool:
-        control = True
-        timeout = time.time() + 120
-        script = "return Glean.serp.impression.testGetValue()"
-        flush_fog_ops = """
-            const callback = arguments[0];
-                (async function () {
-                    try {
-                        await Services.fog.testFlushAllChildren();
-                        callback(true);
-                    } catch (err) {
-                        callback(false);
-                    }
-                })();
-
-            """
         clear_scalars = "Services.telemetry.clearScalars();"
 
-        while control and time.time() < timeout:
-            # flush pending FOG operations
-            with selenium.context(selenium.CONTEXT_CHROME):
-                selenium.execute_async_script(flush_fog_ops)
-
-            time.sleep(30)
-            with selenium.context(selenium.CONTEXT_CHROME):
-                impressions = selenium.execute_script(script)
-
-            logging.info(f"Impressions: {impressions}")
-            match_found = any(
-                isinstance(item, dict)
-                and isinstance(item.get("extra"), dict)
-                and item["extra"].get("provider") == provider
-                and item["extra"].get("source") == source
-                and item["extra"].get("tagged") == tagged
-                for item in impressions
+        with phase("telemetry polling"):
+            snapshot = poll_snapshot(
+                telemetry_snapshot,
+                lambda snapshot: has_impression(snapshot, source, provider, tagged),
+                timeout=120,
+                name="serp.impression",
             )
-
-            if match_found:
-                # Clear scalars and exit
-                try:
-                    with selenium.context(selenium.CONTEXT_CHROME):
-                        selenium.execute_script(clear_scalars)
-                    logging.info("Cleared Impressions")
-                except Exception as e:
-                    logging.warning("Failed to clear scalars: %s", e)
-                return True
-        else:
+        if snapshot is None:
             return False
+        logging.info(f"Impressions: {snapshot['impressions']}")
+
+        # Clear scalars and exit
+        try:
+            with selenium.context(selenium.CONTEXT_CHROME):
+                selenium.execute_script(clear_scalars)
+            logging.info("Cleared Impressions")
+        except Exception as e:
+            logging.warning("Failed to clear scalars: %s", e)
+        telemetry_snapshot.invalidate()
+        return True
 
     return fixture_find_impression_runner
 
 
 @pytest.fixture(name="find_telemetry")
-def fixture_find_telemetry(selenium):
+def fixture_find_telemetry(selenium, telemetry_snapshot):
     def _(ping, scalar=None, value=None, scalar_type="keyedScalars"):
         control = True
         timeout = time.time() + 60
@@ -525,52 +772,47 @@ def fixture_find_telemetry(selenium):
                 })();
         """
 
-        while control and time.time() < timeout:
-            match scalar_type:
-                case "keyedScalars":
-                    script = """
-                        return Services.telemetry.getSnapshotForKeyedScalars("main")
-                    """
-                    with selenium.context(selenium.CONTEXT_CHROME):
-                        telemetry = selenium.execute_script(script)
-                    try:
-                        for item, val in telemetry["parent"].get(ping).items():
-                            if scalar == item and value == val:
-                                logging.info(f"Parent Pings {telemetry['parent']}\n")
-                                return True
-                    except (TypeError, AttributeError, KeyError):
-                        logging.info(f"Parent Pings {telemetry.get('parent')}\n")
-
-                case "scalars":
-                    script = """
-                            return Services.telemetry.getSnapshotForScalars("main")
-                        """
-                    with selenium.context(selenium.CONTEXT_CHROME):
-                        telemetry = selenium.execute_script(script)
-                    assert telemetry["parent"].get(ping) == value
-                    logging.info(f"Parent Pings {telemetry['parent']}\n")
-                    return True
-                case _:
-                    pytest.raises("Incorrect Scalar type")
-            time.sleep(5)
-            with selenium.context(selenium.CONTEXT_CHROME):
-                telemetry = selenium.execute_script(submit_ping_script)
-        else:
-            logging.info("Ping was not found\n")
-            return False
+        with phase("telemetry polling"):
+            while control and time.time() < timeout:
+                snapshot = telemetry_snapshot.get()
+                match scalar_type:
+                    case "keyedScalars":
+                        parent = (snapshot["keyedScalars"] or {}).get("parent")
+                        if has_keyed_scalar(snapshot, ping, scalar, value):
+                            logging.info(f"Parent Pings {parent}\n")
+                            return True
+                        logging.info(f"Parent Pings {parent}\n")
+
+                    case "scalars":
+                        telemetry = snapshot["scalars"]
+                        assert telemetry["parent"].get(ping) == value
+                        logging.info(f"Parent Pings {telemetry['parent']}\n")
+                        return True
+                    case _:
+                        pytest.raises("Incorrect Scalar type")
+                sleep(5)
+                with selenium.context(selenium.CONTEXT_CHROME):
+                    telemetry = selenium.execute_script(submit_ping_script)
+                telemetry_snapshot.invalidate()
+            else:
+                logging.info("Ping was not found\n")
+                return False
 
     return _
 
 
 @pytest.fixture(name="search_server", autouse=True, scope="session")
 def fixture_search_server():
-    process = start_process("search_files", ["python", "search_server.py"])
-    yield "https://localhost:8888"
+    port = free_port()
+    process = start_process(
+        "search_files", ["python", "search_server.py", "--port", f"{port}"], port=port
+    )
+    yield f"https://localhost:{port}"
     process.terminate()
 
 
 @pytest.fixture(name="setup_search_test")
-def fixture_setup_search_test(selenium, firefox):
+def fixture_setup_search_test(selenium, firefox, search_server):
     def _():
         test_data = """
         let SearchSERPTelemetry;
@@ -610,14 +852,14 @@ def fixture_setup_search_test(selenium, firefox):
         """
 
         search_engine = """
-        const callback = arguments[0];
+        const [searchServer, callback] = arguments;
             (async function () {
                 try {
                     installedEngines = await Services.search.getAppProvidedEngines();
                     userEngine = await Services.search.addUserEngine({
                         name: "Moz Search",
-                        url: "https://localhost:8888/searchTelemetryAd.html?s={searchTerms}&abc=ff",
-                        suggest_url: "https://localhost:8888/searchSuggestionEngine.sjs?query={searchTerms}",
+                        url: `${searchServer}/searchTelemetryAd.html?s={searchTerms}&abc=ff`,
+                        suggest_url: `${searchServer}/searchSuggestionEngine.sjs?query={searchTerms}`,
                         alias: "mzsrch",
                     });
                     installedEngines.push(userEngine);
@@ -633,7 +875,7 @@ def fixture_setup_search_test(selenium, firefox):
         """  # noqa
         with selenium.context(selenium.CONTEXT_CHROME):
             selenium.execute_script(test_data)
-            selenium.execute_async_script(search_engine)
+            selenium.execute_async_script(search_engine, search_server)
 
     return _
 
@@ -670,20 +912,30 @@ def fixture_static_server():
     if os.environ.get("DEBIAN_FRONTEND") and not os.environ.get("CI"):
         yield "http://static-server:8000"
     else:
+        port = free_port()
         process = start_process(
-            "tests/fixtures", ["python", "-m", "http.server", "-d", "./", "8000"]
+            "tests/fixtures", ["python", "-m", "http.server", "-d", "./", f"{port}"], port=port
         )
-        yield "http://localhost:8000"
+        yield f"http://localhost:{port}"
         process.terminate()
 
 
-@pytest.fixture(name="ping_server", autouse=True, scope="function")
-def fixture_ping_server():
-    if os.environ.get("DEBIAN_FRONTEND") and not os.environ.get("CI"):
+@pytest.fixture(name="ping_server_url", scope="session")
+def fixture_ping_server_url(request):
+    """Base URL of the ping server shared by every test of the session."""
+    if url := request.config.getoption("--ping-server-url"):
+        yield url.rstrip("/")
+    elif os.environ.get("DEBIAN_FRONTEND") and not os.environ.get("CI"):
         yield "http://ping-server:5000"
     else:
-        process = start_process("ping_server", ["python", "ping_server.py"])
-        yield "http://localhost:5000"
+        log_dir = Path(request.config.getoption("--ping-log-dir")).absolute()
+        port = free_port()
+        process = start_process(
+            "ping_server",
+            ["python", "ping_server.py", "--port", f"{port}", "--log-dir", f"{log_dir}"],
+            port=port,
+        )
+        yield f"http://localhost:{port}"
         if process:
             try:
                 process.terminate()
@@ -696,28 +948,50 @@ def fixture_ping_server():
                 pass
 
 
+@pytest.fixture(name="ping_server", autouse=True, scope="function")
+def fixture_ping_server(request, ping_server_url):
+    """URL of a ping server bucket unique to this test.
+
+    Pings are also logged to ``<ping-log-dir>/<bucket>.jsonl`` when the
+    session started its own ping server.
+    """
+    bucket = f"{node_file_name(request.node)}-{uuid.uuid4().hex[:8]}"
+    yield f"{ping_server_url}/b/{bucket}"
+
+    try:
+        requests.delete(f"{ping_server_url}/b/{bucket}", timeout=5)
+    except (Timeout, ConnectionError) as e:
+        logging.warning(f"Failed to drop ping bucket {bucket}: {e}")
+
+
 @pytest.fixture(name="firefox_version", autouse=True)
-def fixture_firefox_version(selenium):
+def fixture_firefox_version(request, selenium):
     script = """return navigator.userAgent"""
     version = selenium.execute_script(script)
     version = [item for item in version.split() if "Firefox" in item][0]
     logging.info(f"Firefox version {version}")
-    os.environ["FIREFOX_VERSION"] = version.split("/")[-1]
+    request.config.stash[FIREFOX_VERSION] = version.split("/")[-1]
+    if hasattr(request.config, "workeroutput"):  # pytest-xdist worker
+        request.config.workeroutput["firefox_version"] = version.split("/")[-1]
     return version
 
 
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """Collect the Firefox version seen by a pytest-xdist worker."""
+    if version := getattr(node, "workeroutput", {}).get("firefox_version"):
+        node.config.stash[FIREFOX_VERSION] = version
+
+
 @pytest.hookimpl(tryfirst=True)
 def pytest_sessionfinish(session, exitstatus):
     # Add data to html report
-    session.config.stash[metadata_key]["Experiment Slug"] = os.environ.get(
-        "EXPERIMENT_SLUG", "N/A"
-    )
-    session.config.stash[metadata_key]["Experiment Branch"] = os.environ.get(
-        "EXPERIMENT_BRANCH", "N/A"
-    )
-    session.config.stash[metadata_key]["Firefox Version"] = os.environ.get(
-        "FIREFOX_VERSION", "N/A"
+    config = session.config
+    config.stash[metadata_key]["Experiment Slug"] = config.getoption("--experiment-slug") or "N/A"
+    config.stash[metadata_key]["Experiment Branch"] = (
+        config.getoption("--experiment-branch") or "N/A"
     )
+    config.stash[metadata_key]["Firefox Version"] = config.stash.get(FIREFOX_VERSION, "N/A")
 
 
 @then("Firefox should be allowed to open a new tab")
@@ -730,9 +1004,9 @@ def open_a_new_tab(selenium):
 @then("The tab should open successfully")
 def check_new_tab(selenium):
     # get the last tab
-    WebDriverWait(selenium, 60).until(EC.number_of_windows_to_be(3))
+    TimedWait(selenium, 60).until(EC.number_of_windows_to_be(3))
     selenium.switch_to.window(selenium.window_handles[-1])
-    WebDriverWait(selenium, 60).until(EC.url_contains("newtab"))
+    TimedWait(selenium, 60).until(EC.url_contains("newtab"))
     assert "about:newtab" in selenium.current_url
 
 
@@ -32,6 +32,7 @@ Feature: Generic Functionality smoke tests all pass
 
     @smoke
     @xfail
+    @fresh_browser
     Scenario: The browser will allow language packs to be installed
         Given Firefox is launched enrolled in an Experiment with custom search
         Then The user will install a language pack
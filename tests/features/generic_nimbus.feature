@@ -2,7 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-@generic_nimbus
+@generic_nimbus @fresh_browser
 Feature: Generic Nimbus smoke tests all pass
 
     @smoke
@@ -0,0 +1,177 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Memory and CPU footprint of the Firefox process tree during a test."""
+
+import logging
+import os
+import threading
+import typing
+from pathlib import Path
+
+from tests.results import update_json
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PROC_INFO_SCRIPT = """
+    const callback = arguments[arguments.length - 1];
+
+    ChromeUtils.requestProcInfo().then(info => {
+        const byType = {};
+        for (const proc of [info, ...info.children]) {
+            const entry = byType[proc.type] ??= {count: 0, memory: 0, cpuTime: 0};
+            entry.count += 1;
+            entry.memory += proc.memory;
+            entry.cpuTime += proc.cpuTime / 1e9;
+        }
+        callback(byType);
+    }, () => callback(null));
+"""
+
+# Summary values compared between branches.
+COMPARED = ["peak_rss", "peak_uss", "cpu_seconds"]
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def supported() -> bool:
+    """Whether process usage can be read, with psutil or from /proc."""
+    return psutil is not None or os.path.isdir("/proc")
+
+
+def process_tree(pid: int) -> list[int]:
+    """``pid`` and all of its descendants."""
+    if psutil:
+        try:
+            root = psutil.Process(pid)
+            return [pid] + [child.pid for child in root.children(recursive=True)]
+        except psutil.Error:
+            return []
+    if not os.path.isdir("/proc"):
+        return []
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = Path(f"/proc/{entry}/stat").read_text()
+        except OSError:
+            continue
+        # The command name can contain spaces, the fields after it can't.
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def process_usage(pid: int) -> dict[str, float] | None:
+    """RSS and USS in bytes and CPU time in seconds used by one process."""
+    if psutil:
+        try:
+            process = psutil.Process(pid)
+            memory = process.memory_full_info()
+            times = process.cpu_times()
+            return {"rss": memory.rss, "uss": memory.uss, "cpu": times.user + times.system}
+        except psutil.Error:
+            return None
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        statm = Path(f"/proc/{pid}/statm").read_text().split()
+        uss = 0
+        for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                uss += int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        return None
+    return {
+        "rss": int(statm[1]) * _PAGE_SIZE,
+        "uss": uss,
+        "cpu": (int(stat[11]) + int(stat[12])) / _CLOCK_TICKS,
+    }
+
+
+class FootprintSampler(object):
+    """Samples the process tree of a browser on a background thread."""
+
+    def __init__(self, pid: int, interval: float = 1.0) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.samples: list[dict[str, float]] = []
+        self._cpu_start: dict[int, float] = {}
+        self._cpu_last: dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="footprint", daemon=True)
+
+    def start(self) -> "FootprintSampler":
+        self._cpu_start = {pid: usage["cpu"] for pid, usage in self._usage().items()}
+        self._thread.start()
+        return self
+
+    def stop(self) -> dict[str, typing.Any]:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        cpu = sum(last - self._cpu_start.get(pid, 0.0) for pid, last in self._cpu_last.items())
+        return {
+            "samples": len(self.samples),
+            "processes": max((sample["processes"] for sample in self.samples), default=0),
+            "peak_rss": max((sample["rss"] for sample in self.samples), default=0),
+            "peak_uss": max((sample["uss"] for sample in self.samples), default=0),
+            "mean_rss": sum(sample["rss"] for sample in self.samples) / (len(self.samples) or 1),
+            "cpu_seconds": round(cpu, 3),
+        }
+
+    def _usage(self) -> dict[int, dict[str, float]]:
+        usage = {pid: process_usage(pid) for pid in process_tree(self.pid)}
+        return {pid: value for pid, value in usage.items() if value}
+
+    def _sample(self) -> None:
+        usage = self._usage()
+        for pid, value in usage.items():
+            self._cpu_last[pid] = value["cpu"]
+        self.samples.append(
+            {
+                "processes": len(usage),
+                "rss": sum(value["rss"] for value in usage.values()),
+                "uss": sum(value["uss"] for value in usage.values()),
+            }
+        )
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+
+def record(
+    path: Path,
+    branch: str,
+    control_branch: str,
+    test: str,
+    summary: dict[str, typing.Any],
+    threshold: float,
+) -> list[str]:
+    """Store the footprint of ``test`` on ``branch`` and compare it to control.
+
+    Returns the values that grew over control by more than ``threshold``.
+    """
+    with update_json(path, {}) as results:
+        results.setdefault(branch, {})[test] = summary
+
+    control = results.get(control_branch, {}).get(test)
+    if branch == control_branch or control is None:
+        return []
+    regressions = []
+    for name in COMPARED:
+        if control.get(name) and summary.get(name, 0) > control[name] * (1 + threshold):
+            regressions.append(f"{name} {summary[name]} > {control[name]} (control)")
+    logging.info(f"Footprint of {test} on {branch}: {summary}, control: {control}")
+    return regressions
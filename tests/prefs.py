@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Preferences written into every test profile."""
+
+import hashlib
+import json
+import os
+import typing
+from pathlib import Path
+
+# Bump when a change to the prefs must invalidate existing profile templates.
+PREFS_VERSION = 1
+
+BASE_USER_JS = Path("utilities/user.js")
+
+PREFERENCES: dict[str, typing.Any] = {
+    "extensions.install.requireBuiltInCerts": False,
+    "browser.cache.disk.smart_size.enabled": False,
+    "telemetry.fog.test.localhost_port": -1,
+    "toolkit.telemetry.initDelay": 1,
+    "ui.popup.disable_autohide": True,
+    "toolkit.telemetry.minSubsessionLength": 0,
+    "datareporting.healthreport.uploadEnabled": True,
+    "datareporting.policy.dataSubmissionEnabled": True,
+    "datareporting.policy.dataSubmissionPolicyBypassNotification": False,
+    "sticky.targeting.test.pref": True,
+    "toolkit.telemetry.log.level": "Trace",
+    "toolkit.telemetry.log.dump": True,
+    "toolkit.telemetry.send.overrideOfficialCheck": True,
+    "toolkit.telemetry.testing.disableFuzzingDelay": True,
+    "nimbus.debug": True,
+    "app.normandy.run_interval_seconds": 30,
+    "security.content.signature.root_hash": "5E:36:F2:14:DE:82:3F:8B:29:96:89:23:5F:03:41:AC:AF:A0:75:AF:82:CB:4C:D4:30:7C:3D:B3:43:39:2A:FE",  # noqa: E501
+    "datareporting.healthreport.service.enabled": True,
+    "datareporting.healthreport.logging.consoleEnabled": True,
+    "datareporting.healthreport.service.firstRun": True,
+    "datareporting.healthreport.documentServerURI": "https://www.mozilla.org/legal/privacy/firefox.html#health-report",  # noqa: E501
+    "app.normandy.api_url": "https://normandy.cdn.mozilla.net/api/v1",
+    "app.normandy.user_id": "7ef5ab6d-42d6-4c4e-877d-c3174438050a",
+    "messaging-system.log": "debug",
+    "toolkit.telemetry.scheduler.tickInterval": 15,
+    "toolkit.telemetry.collectInterval": 10,
+    "toolkit.telemetry.eventping.minimumFrequency": 3000,
+    "toolkit.telemetry.unified": True,
+    "toolkit.telemetry.eventping.maximumFrequency": 6000,
+    "allowServerURLOverride": True,
+    "browser.aboutConfig.showWarning": False,
+    "browser.newtabpage.enabled": True,
+    "privacy.query_stripping.enabled": False,
+    "remote.system-access-check.enabled": False,
+}
+
+
+def render_user_js(preferences: dict[str, typing.Any] | None = None) -> str:
+    """The contents of utilities/user.js followed by ``preferences``.
+
+    Firefox applies user.js from top to bottom, so the entries appended here
+    win over the ones in utilities/user.js.
+    """
+    lines = [f"// klaatu prefs version {PREFS_VERSION}", BASE_USER_JS.read_text().rstrip()]
+    for name, value in (PREFERENCES if preferences is None else preferences).items():
+        lines.append(f"user_pref({json.dumps(name)}, {json.dumps(value)});")
+    return "\n".join(lines) + "\n"
+
+
+def build_user_js(directory: Path, preferences: dict[str, typing.Any] | None = None) -> Path:
+    """Write the rendered prefs once to ``directory`` and return the file."""
+    contents = render_user_js(preferences)
+    path = Path(directory) / f"user-{hashlib.sha256(contents.encode()).hexdigest()[:12]}.js"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        building = path.with_name(f".{path.name}.{os.getpid()}")
+        building.write_text(contents)
+        os.replace(building, path)
+    return path
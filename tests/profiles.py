@@ -0,0 +1,178 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Cached Firefox profile templates and cheap per-test clones."""
+
+import configparser
+import hashlib
+import logging
+import os
+import queue
+import shutil
+import threading
+import typing
+import uuid
+from pathlib import Path
+from types import ModuleType
+
+fcntl: ModuleType | None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409  # linux/fs.h, clone a whole file as copy-on-write
+# Firefox locks the profile while it runs, never copy the lock files.
+IGNORED_FILES = shutil.ignore_patterns("lock", ".parentlock", "parent.lock")
+
+_reflink_supported = fcntl is not None
+
+UNKNOWN_VERSION = "unknown"
+
+
+def firefox_version(binary: str | None = None) -> str:
+    """Version and build id of a Firefox binary, read from its application.ini."""
+    if path := shutil.which(binary or "firefox"):
+        app_dir = Path(path).resolve().parent
+        for ini in (app_dir / "application.ini", app_dir.parent / "Resources/application.ini"):
+            config = configparser.ConfigParser()
+            if config.read(ini) and config.has_section("App"):
+                return f"{config['App'].get('Version')}-{config['App'].get('BuildID')}"
+    return UNKNOWN_VERSION
+
+
+def file_hash(*paths: Path) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()[:12]
+
+
+def clone_file(src: str, dst: str) -> str:
+    """Copy a file as a copy-on-write reflink when the filesystem allows it.
+
+    Hardlinks are not an option: Firefox rewrites its SQLite databases in
+    place, which would corrupt the template shared by every clone.
+    """
+    global _reflink_supported
+
+    if _reflink_supported and fcntl is not None:
+        try:
+            with open(src, "rb") as source, open(dst, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            # Not supported by this filesystem, stop trying for the session.
+            _reflink_supported = False
+    return shutil.copy2(src, dst)
+
+
+def clone_tree(src: Path, dst: Path) -> Path:
+    shutil.copytree(
+        src,
+        dst,
+        symlinks=True,
+        ignore=IGNORED_FILES,
+        copy_function=clone_file,
+        dirs_exist_ok=True,
+    )
+    return dst
+
+
+class ProfileCache(object):
+    """Builds profile templates once and hands out clones of them.
+
+    Templates are keyed by the base profile, the Firefox version that will use
+    them and a hash of the prefs written into them, so a new Firefox or a prefs
+    change builds a new template instead of reusing a stale one. When the
+    version is unknown, different builds could share a template, so it is
+    built for a single clone and removed afterwards.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root).absolute()
+        self._lock = threading.Lock()
+        self._uncached: set[Path] = set()
+
+    def template(self, base: Path | None, version: str, prefs: Path) -> Path:
+        """Template built from ``base``, or an empty profile when it is None."""
+        name = Path(base).name if base else "minimal"
+        if version == UNKNOWN_VERSION:
+            path = self.root / f".{name}-{version}.{uuid.uuid4().hex}"
+            logging.info(f"Firefox version is unknown, not caching profile template {path.name}")
+            self._build(base, prefs, path)
+            self._uncached.add(path)
+            return path
+        path = self.root / f"{name}-{version}-{file_hash(prefs)}"
+        with self._lock:
+            if not path.exists():
+                logging.info(f"Building profile template {path.name}")
+                building = self.root / f".{path.name}.{uuid.uuid4().hex}"
+                self._build(base, prefs, building)
+                try:
+                    building.rename(path)
+                except OSError:
+                    # Another worker finished the same template first.
+                    shutil.rmtree(building, ignore_errors=True)
+        return path
+
+    def clone(self, template: Path, destination: Path) -> Path:
+        if destination.exists():
+            shutil.rmtree(destination)
+        clone = clone_tree(template, destination)
+        if template in self._uncached:
+            self._uncached.discard(template)
+            shutil.rmtree(template, ignore_errors=True)
+        return clone
+
+    @staticmethod
+    def _build(base: Path | None, prefs: Path, path: Path) -> None:
+        if base:
+            shutil.copytree(
+                Path(base).absolute(),
+                path,
+                symlinks=True,
+                ignore=IGNORED_FILES,
+                ignore_dangling_symlinks=True,
+            )
+        else:
+            path.mkdir(parents=True)
+        shutil.copyfile(prefs, path / "user.js")
+
+
+class ProfileReaper(object):
+    """Deletes used profiles on a background thread.
+
+    ``reap`` only renames the profile out of the way, so the same path can be
+    cloned again straight away while the old copy is removed. Profiles still in
+    use by a pooled browser are ``defer``-ed until the reaper is closed.
+    """
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue[Path | None] = queue.Queue()
+        self._deferred: list[typing.Any] = []
+        self._thread = threading.Thread(target=self._run, name="profile-reaper", daemon=True)
+        self._thread.start()
+
+    def reap(self, profile: typing.Any) -> None:
+        path = Path(profile)
+        if not path.exists():
+            return
+        trash = path.with_name(f".{path.name}.{uuid.uuid4().hex}.trash")
+        os.rename(path, trash)
+        self._queue.put(trash)
+
+    def defer(self, profile: typing.Any) -> None:
+        self._deferred.append(profile)
+
+    def close(self) -> None:
+        for profile in self._deferred:
+            self.reap(profile)
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while (path := self._queue.get()) is not None:
+            shutil.rmtree(path, ignore_errors=True)
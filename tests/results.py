@@ -0,0 +1,39 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Results files shared by the pytest-xdist workers of a test run."""
+
+import json
+import os
+import typing
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from types import ModuleType
+
+fcntl: ModuleType | None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def update_json(path: Path, default: dict) -> typing.Iterator[dict]:
+    """Load ``path``, or ``default`` when it doesn't exist, and write it back.
+
+    Workers take an exclusive lock on a file next to ``path`` for the whole
+    read-modify-write, so one can't drop the results another just wrote, and
+    the new contents replace the file at once, so nobody reads half of it.
+    Nothing is written when the block raises.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(f".{path.name}.lock"), "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        results: dict = json.loads(path.read_text()) if path.exists() else default
+        yield results
+        temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        temporary.write_text(json.dumps(results, indent=2))
+        os.replace(temporary, path)
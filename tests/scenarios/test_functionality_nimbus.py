@@ -1,7 +1,6 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
-import time
 
 import pytest
 from pytest_bdd import given, scenarios, then
@@ -9,7 +8,8 @@ from selenium.webdriver import ActionChains
 from selenium.webdriver.common.actions.action_builder import ActionBuilder
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+
+from tests.timings import TimedWait, sleep
 
 scenarios("../features/generic_functionality.feature")
 
@@ -27,7 +27,7 @@ def navigate_to_url(navigate_using_url_bar, static_server):
 
 @then("The URL should load the webpage successfully")
 def check_url_page_loads_correctly(selenium):
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, ".klaatu-text"))
     )
 
@@ -47,7 +47,7 @@ def copy_and_paste_string_to_url_bar(
     ).send_keys("c").key_up(cmd_or_ctrl_button).perform()
     navigate_using_url_bar(use_clipboard=True)
 
-    WebDriverWait(selenium, 60).until(EC.url_contains(el.text))
+    TimedWait(selenium, 60).until(EC.url_contains(el.text))
 
 
 @pytest.mark.firefox_preferences({"remote.prefs.recommended", False})
@@ -84,25 +84,23 @@ def install_acholi_language_pack(selenium, request):
     selenium.get("https://addons.mozilla.org/en-US/firefox/addon/acholi-ug-language-pack/")
     selenium.find_element(By.CSS_SELECTOR, ".AMInstallButton-button").click()
     with selenium.context(selenium.CONTEXT_CHROME):
-        WebDriverWait(selenium, 60).until(EC.element_to_be_clickable(add_to_firefox_locator))
-        time.sleep(5)  # need to sleep as the waits sometimes don't work
+        TimedWait(selenium, 60).until(EC.element_to_be_clickable(add_to_firefox_locator))
+        sleep(5)  # need to sleep as the waits sometimes don't work
         selenium.find_element(*add_to_firefox_locator).click()
-        WebDriverWait(selenium, 60).until(
-            EC.visibility_of_element_located(addon_installed_locator)
-        )
+        TimedWait(selenium, 60).until(EC.visibility_of_element_located(addon_installed_locator))
         selenium.find_element(*addon_installed_locator).click()
 
     selenium.get("about:preferences")
     button = selenium.find_element(*language_button_locator)
     button.click()
-    WebDriverWait(selenium, 60).until(EC.visibility_of_element_located(root_dialog_box_locator))
+    TimedWait(selenium, 60).until(EC.visibility_of_element_located(root_dialog_box_locator))
     dialog = selenium.find_element(*root_dialog_box_locator)
     selenium.switch_to.frame(dialog)
 
     dialog = selenium.find_element(*browser_dialog_box_locator)
     menu_list = selenium.find_element(*menu_list_locator)
     menu_list.click()
-    WebDriverWait(menu_list, 60).until(EC.visibility_of_element_located(language_search_locator))
+    TimedWait(menu_list, 60).until(EC.visibility_of_element_located(language_search_locator))
     el = menu_list.find_element(*language_search_locator)
     ActionChains(selenium).move_to_element(el).pause(1).click().perform()
     ActionBuilder(selenium).clear_actions()
@@ -113,7 +111,7 @@ def install_acholi_language_pack(selenium, request):
             selenium.execute_script("arguments[0].scrollIntoView(true);", item)
             ActionChains(selenium).move_to_element(item).pause(1).click().pause(1).perform()
             break
-    WebDriverWait(dialog, 60).until(
+    TimedWait(dialog, 60).until(
         EC.element_to_be_clickable(add_button_locator), message="Language was not added"
     )
     dialog.find_element(*add_button_locator).click()
@@ -127,7 +125,7 @@ def check_for_localized_firefox(selenium):
     selenium.get("about:preferences")
     locales = selenium.find_element(*locales_locator)
     locales.click()
-    list = WebDriverWait(locales, 60).until(
+    list = TimedWait(locales, 60).until(
         EC.presence_of_all_elements_located((By.CSS_SELECTOR, "menuitem"))
     )
     for item in list:
@@ -138,7 +136,7 @@ def check_for_localized_firefox(selenium):
     This translates from:
     Choose the languages used to display menus, messages, and notifications from Firefox.
     """
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.text_to_be_present_in_element(
             text_locator,
             "Yer leb ma kitiyo kwedgi me nyuto jami ayera, kwena, ki jami angeya ki ii Firefox.",
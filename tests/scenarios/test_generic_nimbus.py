@@ -8,7 +8,8 @@ import time
 from pytest_bdd import scenarios, then
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+
+from tests.timings import TimedWait, sleep
 
 scenarios("../features/generic_nimbus.feature")
 
@@ -27,12 +28,12 @@ def unenroll_via_studies_page(selenium, experiment_json):
     timeout = timeout = time.time() + 60
     while time.time() < timeout:
         selenium.get("about:studies")
-        WebDriverWait(selenium, 30).until(EC.presence_of_element_located(study_name_locator))
+        TimedWait(selenium, 30).until(EC.presence_of_element_located(study_name_locator))
         items = selenium.find_elements(*study_name_locator)
         if any(item for item in items if experiment_json["userFacingName"] in item.text):
             logging.info("Experiment unenrolled")
             return True
-        time.sleep(2)
+        sleep(2)
 
 
 @then("the Experiment is shown as disabled on about:studies page")
@@ -52,13 +53,13 @@ def check_experiment_is_disabled_on_about_studies(selenium, experiment_json):
 @then("The experiment can be unenrolled via opting out of studies")
 def opt_out_via_about_preferences(selenium):
     selenium.get("about:preferences")
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, "#preferences-body")),
         message="about:preferences page did not load.",
     )
     el = selenium.find_element(By.CSS_SELECTOR, "#category-privacy")
     el.click()
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, "#browserPrivacyCategory")),
         message="about:preferences Privacy page did not load.",
     )
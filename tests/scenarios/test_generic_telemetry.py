@@ -3,14 +3,14 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import logging
-import time
 
 import requests
 from pytest_bdd import parsers, scenario, scenarios, then
 from selenium.webdriver import ActionChains, Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
+
+from tests.timings import TimedWait, sleep
 
 scenarios(
     "../features/withads_search.feature",
@@ -101,7 +101,7 @@ def search_using_search_bar_to_return_ads(selenium, enable_search_bar):
 
     # perform search
     with selenium.context(selenium.CONTEXT_CHROME):
-        WebDriverWait(selenium, 60).until(EC.visibility_of_element_located(search_box_locator))
+        TimedWait(selenium, 60).until(EC.visibility_of_element_located(search_box_locator))
         search_bar = selenium.find_element(*search_box_locator)
         search_bar.send_keys("buy stocks")
         search_bar.send_keys(Keys.ENTER)
@@ -118,9 +118,9 @@ def search_using_context_click_menu(selenium, static_server, find_telemetry):
     with selenium.context(selenium.CONTEXT_CHROME):
         menu = selenium.find_element(By.CSS_SELECTOR, "#contentAreaContextMenu")
         menu.find_element(By.CSS_SELECTOR, "#context-searchselect").click()
-    WebDriverWait(selenium, 60).until(EC.number_of_windows_to_be(3))
+    TimedWait(selenium, 60).until(EC.number_of_windows_to_be(3))
     selenium.switch_to.window(selenium.window_handles[1])
-    time.sleep(5)
+    sleep(5)
 
 
 @then("The user highlights some text and wants to search for it via the contextmenu")
@@ -137,7 +137,7 @@ def search_using_context_click_menu_full(selenium, static_server, find_telemetry
         with selenium.context(selenium.CONTEXT_CHROME):
             menu = selenium.find_element(By.CSS_SELECTOR, "#contentAreaContextMenu")
             menu.find_element(By.CSS_SELECTOR, "#context-searchselect").click()
-        WebDriverWait(selenium, 60).until(EC.number_of_windows_to_be(current_windows + 1))
+        TimedWait(selenium, 60).until(EC.number_of_windows_to_be(current_windows + 1))
         try:
             assert find_telemetry(
                 "browser.search.withads.contextmenu", scalar="klaatu:tagged", value=1
@@ -229,7 +229,7 @@ def perform_background_search(selenium):
         ActionChains(selenium).key_down(Keys.ALT).key_down(Keys.SHIFT).key_down(
             Keys.ENTER
         ).perform()
-    WebDriverWait(selenium, 60).until(EC.number_of_windows_to_be(4))
+    TimedWait(selenium, 60).until(EC.number_of_windows_to_be(4))
     selenium.switch_to.window(selenium.window_handles[-1])
 
 
@@ -240,13 +240,13 @@ def refresh_page(selenium):
 
 @then("The browser is closed")
 def close_browser(selenium):
-    time.sleep(15)  # wait a little to not cause a race condition
+    sleep(15)  # wait a little to not cause a race condition
     selenium.quit()
 
 
 @then("The page loads")
 def wait_for_ad_click_page_to_load(selenium):
-    WebDriverWait(selenium, 60).until(EC.visibility_of_element_located((By.CSS_SELECTOR, "body")))
+    TimedWait(selenium, 60).until(EC.visibility_of_element_located((By.CSS_SELECTOR, "body")))
 
 
 @then("The user goes back to the search page")
@@ -254,10 +254,10 @@ def go_back_one_page(selenium):
     url = selenium.current_url
     logging.info(url)
     selenium.back()
-    time.sleep(5)
+    sleep(5)
     logging.info(selenium.current_url)
     # wait some time after going back so the event can register
-    WebDriverWait(selenium, 30).until(EC.url_changes(url))
+    TimedWait(selenium, 30).until(EC.url_changes(url))
 
 
 @then("The user goes back to the clicked ad")
@@ -273,11 +273,11 @@ def load_and_search_on_mozsearch(selenium, search_server):
 
 @then("The user clicks on an ad")
 def click_on_ad_local_search(selenium):
-    time.sleep(10)
+    sleep(10)
     el = selenium.find_element(By.CSS_SELECTOR, "#ad1")
     el.click()
     logging.info(f"Ad URL: {selenium.current_url}\n")
-    time.sleep(10)
+    sleep(10)
 
 
 @then("The user triggers a follow-on search")
@@ -288,13 +288,14 @@ def trigger_follow_on_search(selenium, search_server):
 
 @then("The subsession and subsession length is correctly reported")
 def check_telemetry_for_subsession_length(ping_server):
-    data = requests.get(f"{ping_server}/pings", timeout=10).json()
+    data = requests.get(
+        f"{ping_server}/pings/summary", params={"doc_type": "main"}, timeout=10
+    ).json()
     for item in data:
-        try:
-            assert item.get("payload").get("info").get("subsessionLength") is not None
-            assert item.get("payload").get("info").get("sessionLength") is not None
+        if (
+            item["session"].get("subsessionLength") is not None
+            and item["session"].get("sessionLength") is not None
+        ):
             break
-        except (AttributeError, AssertionError):
-            continue
     else:
         assert False
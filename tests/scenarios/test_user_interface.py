@@ -10,12 +10,12 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
 
 from tests.expected import (
     firefox_update_banner_is_found,
     firefox_update_banner_is_invisible,
 )
+from tests.timings import TimedWait
 
 
 @scenario("../features/user_interface.feature", "The browser can navigate effectively")
@@ -71,7 +71,7 @@ def page_loads(selenium):
 @then("The Experiment should be shown on the about:studies page")
 def studies_page_shows_experiment(selenium, experiment_json):
     selenium.get("about:studies")
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, ".study-name")),
         message="Experiment not shown on about:studies.",
     )
@@ -97,7 +97,17 @@ def support_page_shows_experiment(selenium, experiment_slug):
 
 
 @then("Firefox should not be slowed down")
-def firefox_speed(selenium, firefox_startup_time):
+def firefox_speed(request, selenium, startup_benchmark):
+    if results := startup_benchmark():
+        branch = request.config.getoption("--experiment-branch")
+        if branch == results["control"]:
+            return  # treatment branches are compared against these samples
+        if branch not in results["verdict"]:
+            pytest.skip(f"No {results['control']} branch startup benchmark to compare with yet")
+        verdict = results["verdict"][branch]
+        assert verdict["result"] == "ok", f"Startup regressions: {verdict['regressions']}"
+        return
+    firefox_startup_time = request.getfixturevalue("firefox_startup_time")
     startup = selenium.execute_script(
         """
         perfData = window.performance.timing
@@ -115,7 +125,7 @@ def update_firefox(selenium, request):
         pytest.skip("needs --run-update-test option to run")
         return
     with selenium.context(selenium.CONTEXT_CHROME):
-        WebDriverWait(selenium, 60).until(
+        TimedWait(selenium, 60).until(
             firefox_update_banner_is_found(),
             message="Update banner not found",
         )
@@ -146,7 +156,7 @@ def start_updated_firefox():
     # Start Firefox and test
     selenium = webdriver.Firefox(options=options)
     selenium.get("https://www.allizom.org")
-    WebDriverWait(selenium, 10).until(
+    TimedWait(selenium, 10).until(
         firefox_update_banner_is_invisible(),
         message="Update banner found, maybe firefox didn't update?",
     )
@@ -156,7 +166,7 @@ def start_updated_firefox():
 @then("The experiment is still enrolled")
 def check_experiment_is_still_enrolled(selenium, experiment_json):
     selenium.get("about:studies")
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, ".study-name")),
         message="Experiment not shown on about:studies.",
     )
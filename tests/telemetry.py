@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""One round trip snapshots of the telemetry recorded by the browser."""
+
+import logging
+import time
+import typing
+
+SNAPSHOT_SCRIPT = """
+    const [nimbusEvents, flush, callback] = arguments;
+
+    (async function () {
+        const snapshot = {nimbusEvents: {}, errors: []};
+        const collect = (name, getter) => {
+            try {
+                snapshot[name] = getter();
+            } catch (err) {
+                snapshot[name] = null;
+                snapshot.errors.push(`${name}: ${err}`);
+            }
+        };
+
+        if (flush) {
+            try {
+                await Services.fog.testFlushAllChildren();
+            } catch (err) {
+                snapshot.errors.push(`flush: ${err}`);
+            }
+        }
+        for (const event of nimbusEvents) {
+            try {
+                snapshot.nimbusEvents[event] = Glean.nimbusEvents[event].testGetValue("events");
+            } catch (err) {
+                snapshot.nimbusEvents[event] = null;
+                snapshot.errors.push(`${event}: ${err}`);
+            }
+        }
+        collect("keyedScalars", () => Services.telemetry.getSnapshotForKeyedScalars("main"));
+        collect("scalars", () => Services.telemetry.getSnapshotForScalars("main"));
+        collect("impressions", () => Glean.serp.impression.testGetValue());
+        callback(snapshot);
+    })();
+"""
+
+
+class TelemetrySnapshots(object):
+    """Reads Glean events, scalars and SERP impressions in one script call.
+
+    Snapshots are cached for ``max_age`` seconds so several checks made in a
+    row share a single Marionette round trip. Call ``invalidate`` after doing
+    anything that changes the recorded telemetry.
+    """
+
+    def __init__(self, driver: typing.Any, max_age: float = 1.0) -> None:
+        self.driver = driver
+        self.max_age = max_age
+        self._snapshot: dict | None = None
+        self._taken = 0.0
+
+    def get(self, nimbus_events: typing.Iterable[str] = (), flush: bool = False) -> dict:
+        events = [event for event in nimbus_events if event]
+        if (
+            self._snapshot is None
+            or flush
+            or time.monotonic() - self._taken > self.max_age
+            or any(event not in self._snapshot["nimbusEvents"] for event in events)
+        ):
+            start = time.monotonic()
+            with self.driver.context(self.driver.CONTEXT_CHROME):
+                self._snapshot = self.driver.execute_async_script(SNAPSHOT_SCRIPT, events, flush)
+            self._taken = time.monotonic()
+            logging.debug(f"Telemetry snapshot took {self._taken - start:.3f}s")
+            for error in self._snapshot.get("errors", []):
+                logging.debug(f"Telemetry snapshot: {error}")
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        self._snapshot = None
+
+
+def poll_snapshot(
+    snapshots: TelemetrySnapshots,
+    predicate: typing.Callable[[dict], bool],
+    timeout: float,
+    interval: float = 0.1,
+    max_interval: float = 5.0,
+    name: str = "telemetry",
+) -> dict | None:
+    """Take snapshots until ``predicate`` holds or ``timeout`` seconds pass.
+
+    The wait between attempts starts at ``interval`` and doubles up to
+    ``max_interval``. Child processes are only flushed to FOG once the first
+    attempt missed, since most telemetry is recorded in the parent.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    flush = False
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_start = time.monotonic()
+        snapshot = snapshots.get(flush=flush)
+        found = predicate(snapshot)
+        now = time.monotonic()
+        logging.info(
+            f"{name} attempt {attempt}: {'found' if found else 'missing'} "
+            f"(flush={flush}, {now - attempt_start:.3f}s, {now - start:.3f}s total)"
+        )
+        if found:
+            return snapshot
+        if now >= deadline:
+            return None
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, max_interval)
+        flush = True
+
+
+def has_keyed_scalar(snapshot: dict, ping: str, scalar: str, value: typing.Any) -> bool:
+    parent = (snapshot.get("keyedScalars") or {}).get("parent") or {}
+    return bool((parent.get(ping) or {}).get(scalar) == value)
+
+
+def has_impression(snapshot: dict, source: str, provider: str, tagged: typing.Any) -> bool:
+    return any(
+        isinstance(item, dict)
+        and isinstance(item.get("extra"), dict)
+        and item["extra"].get("provider") == provider
+        and item["extra"].get("source") == source
+        and item["extra"].get("tagged") == tagged
+        for item in snapshot.get("impressions") or []
+    )
+
+
+def has_nimbus_event(snapshot: dict, event: str, experiment: str) -> bool:
+    return any(
+        item["name"] == event and item["extra"]["experiment"] == experiment
+        for item in snapshot["nimbusEvents"].get(event) or []
+    )
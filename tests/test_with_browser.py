@@ -10,12 +10,12 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.wait import WebDriverWait
 
 from tests.expected import (
     firefox_update_banner_is_found,
     firefox_update_banner_is_invisible,
 )
+from tests.timings import TimedWait
 
 
 @pytest.mark.nondestructive
@@ -57,7 +57,7 @@ def test_experiment_shows_on_support_page(selenium: typing.Any, experiment_slug:
 def test_experiment_shows_on_studies_page(selenium: typing.Any, experiment_json: dict):
     """Experiment should show on about:studies page."""
     selenium.get("about:studies")
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, ".study-name")),
         message="Experiment not shown on about:studies.",
     )
@@ -252,7 +252,7 @@ def test_experiment_does_not_stop_update(
     selenium.get("about:profiles")
     # Sleep to let firefox update
     with selenium.context(selenium.CONTEXT_CHROME):
-        WebDriverWait(selenium, 60).until(
+        TimedWait(selenium, 60).until(
             firefox_update_banner_is_found(),
             message="Update banner not found",
         )
@@ -280,13 +280,13 @@ def test_experiment_does_not_stop_update(
     # Start Firefox and test
     selenium = webdriver.Firefox(firefox_binary=binary, options=options)
     selenium.get("https://www.allizom.org")
-    WebDriverWait(selenium, 10).until(
+    TimedWait(selenium, 10).until(
         firefox_update_banner_is_invisible(),
         message="Update banner found, maybe firefox didn't update?",
     )
     selenium.get("about:studies")
     print(selenium.page_source)
-    WebDriverWait(selenium, 60).until(
+    TimedWait(selenium, 60).until(
         EC.visibility_of_element_located((By.CSS_SELECTOR, ".study-name")),
         message="Experiment not shown on about:studies.",
     )
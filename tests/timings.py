@@ -0,0 +1,191 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""pytest plugin recording where each test spends its wall clock time."""
+
+import html
+import json
+import threading
+import time
+import typing
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import pytest
+from selenium.webdriver.support.wait import WebDriverWait
+
+FIXTURE_PHASES = {
+    "setup_profile": "profile copy",
+    "selenium": "browser launch",
+    "driver": "browser launch",
+    "enroll_experiment": "enrollment",
+}
+COLORS = ["#4e79a7", "#f28e2b", "#e15759", "#76b7b2", "#59a14f", "#edc948", "#b07aa1"]
+
+
+@dataclass
+class Frame(object):
+    """A phase on the stack and the time spent in the phases inside it."""
+
+    name: str
+    start: float
+    waits: bool
+    children: float = 0.0
+
+
+class Timings(object):
+    """Self time per phase of the running test.
+
+    Phases nest: the time spent in an inner phase is only counted for that
+    phase, not for the ones around it. Sleeps inside a waiting phase, such as
+    the polling done by TimedWait, count towards the waiting phase.
+    """
+
+    def __init__(self) -> None:
+        self.current: dict[str, float] = defaultdict(float)
+        self._stack: list[Frame] = []
+
+    @contextmanager
+    def phase(self, name: str, waits: bool = False) -> typing.Iterator[None]:
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        frame = Frame(name, time.perf_counter(), waits)
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame.start
+            self.current[name] += elapsed - frame.children
+            if self._stack:
+                self._stack[-1].children += elapsed
+
+    @property
+    def waiting(self) -> bool:
+        return any(frame.waits for frame in self._stack)
+
+    def take(self) -> dict[str, float]:
+        result = {name: round(seconds, 3) for name, seconds in self.current.items()}
+        self.current.clear()
+        return result
+
+
+TIMINGS = Timings()
+
+
+def phase(name: str) -> typing.ContextManager[None]:
+    """Record a block of a fixture or step as a waiting phase of the test."""
+    return TIMINGS.phase(name, waits=True)
+
+
+def sleep(seconds: float) -> None:
+    """``time.sleep`` recorded as a "sleep" phase outside of waiting phases."""
+    if TIMINGS.waiting:
+        return time.sleep(seconds)
+    with TIMINGS.phase("sleep"):
+        return time.sleep(seconds)
+
+
+class TimedWait(WebDriverWait):
+    """WebDriverWait recording its polling as the "WebDriver waits" phase.
+
+    Only waits made through this class are recorded, WebDriverWait itself and
+    time.sleep are left alone for other plugins and libraries.
+    """
+
+    def until(self, *args, **kwargs):
+        with TIMINGS.phase("WebDriver waits", waits=True):
+            return super().until(*args, **kwargs)
+
+    def until_not(self, *args, **kwargs):
+        with TIMINGS.phase("WebDriver waits", waits=True):
+            return super().until_not(*args, **kwargs)
+
+
+def render_html(timings: dict[str, float]) -> str:
+    """A stacked bar of the phases followed by a table of their times."""
+    total = sum(timings.values()) or 1
+    ordered = sorted(timings.items(), key=lambda item: item[1], reverse=True)
+    bar = "".join(
+        f'<div title="{html.escape(name)}: {seconds:.2f}s" '
+        f'style="width:{100 * seconds / total:.2f}%;background:{COLORS[i % len(COLORS)]}"></div>'
+        for i, (name, seconds) in enumerate(ordered)
+    )
+    rows = "".join(
+        f'<tr><td style="color:{COLORS[i % len(COLORS)]}">&#9632;</td>'
+        f"<td>{html.escape(name)}</td><td>{seconds:.2f}s</td>"
+        f"<td>{100 * seconds / total:.1f}%</td></tr>"
+        for i, (name, seconds) in enumerate(ordered)
+    )
+    return f'<div style="display:flex;height:18px;width:100%">{bar}</div><table>{rows}</table>'
+
+
+class TimingsPlugin(object):
+    def __init__(self, config: typing.Any) -> None:
+        self.config = config
+        self.path = Path(config.getoption("--timings-json"))
+        self.results: dict[str, dict[str, float]] = {}
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef: typing.Any, request: typing.Any):
+        name = FIXTURE_PHASES.get(fixturedef.argname)
+        if name is None:
+            yield
+            return
+        with TIMINGS.phase(name):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item: typing.Any):
+        with TIMINGS.phase("other setup"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item: typing.Any):
+        with TIMINGS.phase("steps and assertions"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item: typing.Any):
+        with TIMINGS.phase("teardown"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item: typing.Any, call: typing.Any):
+        outcome = yield
+        if call.when != "teardown":
+            return
+        report = outcome.get_result()
+        timings = TIMINGS.take()
+        report.user_properties.append(("timings", timings))
+        if pytest_html := item.config.pluginmanager.getplugin("html"):
+            extras = getattr(report, "extras", [])
+            extras.append(pytest_html.extras.html(render_html(timings)))
+            report.extras = extras
+
+    def pytest_runtest_logreport(self, report: typing.Any) -> None:
+        for key, value in report.user_properties:
+            if key == "timings":
+                self.results[report.nodeid] = value
+
+    def pytest_sessionfinish(self, session: typing.Any) -> None:
+        if hasattr(session.config, "workeroutput"):
+            return  # the pytest-xdist controller writes the summary
+        totals: dict[str, float] = defaultdict(float)
+        for timings in self.results.values():
+            for name, seconds in timings.items():
+                totals[name] += seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(
+            json.dumps(
+                {
+                    "totals": {name: round(seconds, 3) for name, seconds in totals.items()},
+                    "tests": self.results,
+                },
+                indent=2,
+            )
+        )
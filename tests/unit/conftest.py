@@ -0,0 +1,41 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Unit tests of the harness helpers, which need no browser or servers.
+
+The autouse fixtures of tests/conftest.py that start servers or a browser are
+overridden here so they do nothing.
+"""
+
+import pytest
+
+
+@pytest.fixture(name="search_server", scope="session")
+def fixture_search_server():
+    return None
+
+
+@pytest.fixture(name="static_server", scope="session")
+def fixture_static_server():
+    return None
+
+
+@pytest.fixture(name="ping_server")
+def fixture_ping_server():
+    return None
+
+
+@pytest.fixture(name="enroll_experiment")
+def fixture_enroll_experiment():
+    return None
+
+
+@pytest.fixture(name="footprint")
+def fixture_footprint():
+    return None
+
+
+@pytest.fixture(name="firefox_version")
+def fixture_firefox_version():
+    return None
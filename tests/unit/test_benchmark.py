@@ -0,0 +1,121 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pytest
+
+from tests.benchmark import (
+    ENROLL_SCRIPT,
+    ENROLLED_SCRIPT,
+    STARTUP_SCRIPT,
+    StartupBenchmark,
+    record,
+)
+
+SLUG = "klaatu-test"
+RECIPE = {"slug": SLUG, "branches": [{"slug": "control"}, {"slug": "treatment"}]}
+
+
+class FakeDriver(object):
+    """Answers the benchmark scripts like an enrolled Firefox would."""
+
+    CONTEXT_CHROME = "chrome"
+    enrolls_active = True
+
+    def __init__(self, profile, store, launches):
+        self.profile = profile
+        self.store = store
+        self.launches = launches
+        self.quit_called = False
+        launches.append(profile)
+
+    @contextmanager
+    def context(self, context):
+        yield
+
+    def execute_async_script(self, script, *args):
+        if script == ENROLL_SCRIPT:
+            recipe, branch = args
+            if branch not in [b["slug"] for b in recipe["branches"]]:
+                return {"success": False, "error": f"Branch {branch} is not in the recipe"}
+            # Like ExperimentManager.forceEnroll, which stores the opt-in slug.
+            self.store[f"optin-{recipe['slug']}"] = {"active": self.enrolls_active}
+            return True
+        if script == ENROLLED_SCRIPT:
+            return self.store.get(args[0], {}).get("active", False)
+        if script == STARTUP_SCRIPT:
+            return {"main": 100, "firstPaint": 250, "sessionRestored": 400, "memory": 2**20}
+        raise AssertionError("Unexpected script")
+
+    def quit(self):
+        self.quit_called = True
+
+
+@pytest.fixture(name="benchmark")
+def fixture_benchmark(tmp_path):
+    store, launches = {}, []
+    template = tmp_path / "template"
+    template.mkdir()
+    (template / "user.js").write_text("")
+    benchmark = StartupBenchmark(
+        lambda profile: FakeDriver(profile, store, launches), tmp_path / "work"
+    )
+    return benchmark, template, launches
+
+
+def test_run_collects_cold_and_warm_samples(benchmark):
+    startup_benchmark, template, launches = benchmark
+
+    samples = startup_benchmark.run(template, RECIPE, "treatment", 3)
+
+    assert len(launches) == 1 + 3 * 2
+    for kind in ("cold", "warm"):
+        assert samples[kind]["main"] == [100, 100, 100]
+        assert samples[kind]["memory"] == [2**20] * 3
+
+
+def test_run_fails_for_a_branch_missing_from_the_recipe(benchmark):
+    startup_benchmark, template, launches = benchmark
+
+    with pytest.raises(AssertionError, match="Force enrollment failed"):
+        startup_benchmark.run(template, RECIPE, "missing", 3)
+    assert len(launches) == 1
+
+
+def test_run_fails_when_the_experiment_is_not_active(benchmark, monkeypatch):
+    startup_benchmark, template, launches = benchmark
+    monkeypatch.setattr(FakeDriver, "enrolls_active", False)
+
+    with pytest.raises(AssertionError, match="is not active"):
+        startup_benchmark.run(template, RECIPE, "treatment", 3)
+    assert len(launches) == 1
+
+
+def test_record_flags_a_slower_branch(tmp_path):
+    path = tmp_path / f"{SLUG}.json"
+    control = {"main": [100.0 + i for i in range(10)]}
+    treatment = {"main": [200.0 + i for i in range(10)]}
+
+    record(path, "control", "control", {"cold": control, "warm": control}, 0.05, 0.05)
+    results = record(
+        path, "treatment", "control", {"cold": treatment, "warm": control}, 0.05, 0.05
+    )
+
+    assert results["verdict"]["treatment"]["result"] == "slower"
+    assert results["verdict"]["treatment"]["regressions"] == ["cold main"]
+
+
+def test_record_keeps_the_samples_of_parallel_workers(tmp_path):
+    path = tmp_path / f"{SLUG}.json"
+    samples = {"cold": {"main": [100.0]}, "warm": {"main": [100.0]}}
+    branches = [f"branch-{i}" for i in range(20)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for branch in branches:
+            executor.submit(record, path, branch, "control", samples, 0.05, 0.05)
+
+    assert sorted(json.loads(path.read_text())["branches"]) == sorted(branches)
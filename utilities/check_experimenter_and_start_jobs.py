@@ -1,62 +1,206 @@
+import ast
+import hashlib
 import json
 import os
 import re
-import subprocess
+import threading
 import time
-from dateutil import parser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from packaging.version import parse, Version
 from pathlib import Path
-from collections import defaultdict
 
 import requests
-
+from dateutil import parser
+from packaging.version import Version, parse
+from requests.adapters import HTTPAdapter
 
 experimenter_url = "https://experimenter.services.mozilla.com/api/v6/experiments/?=status=Preview"
-run_flag = False
-testing_list = {}
-path = Path().cwd()
-
-versions = requests.get("https://whattrainisitnow.com/api/firefox/releases/").json()
-
-def trigger_github_action(slug, branch, firefox_version, workflow_id):
-    url = f'https://api.github.com/repos/jrbenny35/klaatu/actions/workflows/{workflow_id}/dispatches'
-    inputs = {
-        'slug': slug,
-        'branch': branch,
-        'firefox-version': f"{firefox_version}"
-    }
+versions_url = "https://whattrainisitnow.com/api/firefox/releases/"
+workflows_url = "https://api.github.com/repos/jrbenny35/klaatu/actions/workflows"
+
+CACHE_DIR = Path(os.getenv("KLAATU_HTTP_CACHE", ".http_cache"))
+STATE_FILE = Path(os.getenv("KLAATU_STATE_FILE", "experiment_state.json"))
+# GitHub asks for at least a second between requests that create content and
+# limits them to 80 a minute, dispatches count as such requests.
+DISPATCH_INTERVAL = float(os.getenv("KLAATU_DISPATCH_INTERVAL", 1.0))
+DISPATCH_WORKERS = int(os.getenv("KLAATU_DISPATCH_WORKERS", 4))
+# The parts of a recipe that change what a test run does. Experimenter also
+# updates fields such as the publish dates, which don't need another run.
+TESTED_RECIPE_FIELDS = ("branches", "targeting", "featureIds", "channel")
+
+
+class ResponseCache(object):
+    """JSON responses kept on disk and revalidated with ETag / Last-Modified."""
+
+    def __init__(self, session, directory):
+        self.session = session
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, url):
+        path = self.directory / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+        cached = json.loads(path.read_text()) if path.exists() else None
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self.session.get(url, headers=headers, timeout=30)
+        if response.status_code == 304 and cached:
+            print(f"{url} not modified, using cached response")
+            return cached["body"]
+        response.raise_for_status()
+        body = response.json()
+        path.write_text(
+            json.dumps(
+                {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "body": body,
+                }
+            )
+        )
+        return body
+
+
+class RateLimiter(object):
+    """Spaces calls at least ``interval`` seconds apart across threads.
+
+    ``pause`` holds every caller back, for when GitHub asks to retry later.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if delay:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+class ExperimentState(object):
+    """What was already dispatched for each experiment, kept in a JSON file.
+
+    Every experiment records the hash of the recipe it was tested with and the
+    "<workflow>:<version>" combinations dispatched for it. A recipe whose
+    branches, targeting, features or channel changed is tested again on every
+    version.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.experiments = (
+            json.loads(self.path.read_text())["experiments"] if self.path.exists() else {}
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def recipe_hash(recipe):
+        tested = {name: recipe.get(name) for name in TESTED_RECIPE_FIELDS}
+        return hashlib.sha256(json.dumps(tested, sort_keys=True).encode()).hexdigest()
+
+    def untested(self, slug, recipe, workflow_id, firefox_versions):
+        """The versions of ``firefox_versions`` not dispatched yet on ``workflow_id``."""
+        entry = self.experiments.get(slug)
+        if entry is None or entry["recipe_hash"] != self.recipe_hash(recipe):
+            return list(firefox_versions)
+        tested = set(entry["tested"])
+        return [
+            version for version in firefox_versions if f"{workflow_id}:{version}" not in tested
+        ]
+
+    def mark_tested(self, slug, recipe, workflow_id, firefox_versions):
+        recipe_hash = self.recipe_hash(recipe)
+        with self._lock:
+            entry = self.experiments.get(slug)
+            if entry is None or entry["recipe_hash"] != recipe_hash:
+                entry = self.experiments[slug] = {"recipe_hash": recipe_hash, "tested": []}
+            entry["tested"] = sorted(
+                set(entry["tested"]) | {f"{workflow_id}:{version}" for version in firefox_versions}
+            )
+            entry["updated"] = datetime.now().isoformat()
+
+    def prune(self, slugs):
+        """Forget experiments Experimenter doesn't list anymore."""
+        self.experiments = {
+            slug: entry for slug, entry in self.experiments.items() if slug in slugs
+        }
+
+    def save(self):
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps({"experiments": self.experiments}, indent=2))
+        os.replace(temporary, self.path)
+
+
+def make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=DISPATCH_WORKERS)
+    session.mount("https://", adapter)
+    return session
+
+
+def retry_after(response):
+    """Seconds GitHub wants us to wait, or None when the request can't be retried."""
+    if response.status_code not in (403, 429):
+        return None
+    if "Retry-After" in response.headers:
+        return float(response.headers["Retry-After"])
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = response.headers.get("X-RateLimit-Reset")
+        return max(0.0, float(reset) - time.time()) if reset else 60.0
+    if response.status_code == 429 or "secondary rate limit" in response.text:
+        return 60.0
+    return None
+
+
+def trigger_github_action(session, limiter, slug, branch, firefox_version, workflow_id, tries=3):
+    url = f"{workflows_url}/{workflow_id}/dispatches"
+    inputs = {"slug": slug, "branch": branch, "firefox-version": f"{firefox_version}"}
 
     headers = {
-        'Accept': 'application/vnd.github.v3+json',
-        'Authorization': f"Bearer {os.getenv('BEARER_TOKEN')}" ,
-        'X-GitHub-Api-Version': '2022-11-28'
-    }
-    
-    data = {
-        'ref': 'main',
-        'inputs': inputs or {}
+        "Accept": "application/vnd.github.v3+json",
+        "Authorization": f"Bearer {os.getenv('BEARER_TOKEN')}",
+        "X-GitHub-Api-Version": "2022-11-28",
     }
+
+    data = {"ref": "main", "inputs": inputs or {}}
     print(f"Running tests for {inputs['slug']}, with data {data}, on workflow {workflow_id}")
 
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    
-    if response.status_code == 204:
-        print('Workflow triggered successfully!')
-    else:
-        print(f'Failed to trigger workflow: {response.status_code}')
-        print(response.text)
+    for _ in range(tries):
+        limiter.wait()
+        response = session.post(url, headers=headers, data=json.dumps(data), timeout=30)
+        if response.status_code == 204:
+            print(f"Workflow {workflow_id} triggered successfully for {slug}!")
+            return True
+        if (delay := retry_after(response)) is None:
+            break
+        print(f"Rate limited by GitHub, retrying {slug} on {workflow_id} in {delay:.0f}s")
+        limiter.pause(delay)
+    print(f"Failed to trigger workflow: {response.status_code}")
+    print(response.text)
+    return False
+
 
 def get_latest_versions(versions, min_version):
     # Parse versions and group by major.minor
 
     version_list = []
 
-    from packaging.version import Version
-    
     for version in versions.keys():
         if Version(version) >= Version(min_version[0]):
-           version_list.append(version)
+            version_list.append(version)
 
     version_groups = defaultdict(list)
     for version_str in version_list:
@@ -64,27 +208,27 @@ def get_latest_versions(versions, min_version):
         major_minor = f"{version.major}.{version.minor}"
         version_groups[major_minor].append(version)
 
-
     # Determine the latest version in each group
     latest_versions = {}
-    for major_minor, versions in version_groups.items():
-        latest_versions[major_minor] = max(versions, key=lambda v: (v.major, v.minor, v.micro))
-    
+    for major_minor, grouped in version_groups.items():
+        latest_versions[major_minor] = max(grouped, key=lambda v: (v.major, v.minor, v.micro))
+
     # Return the latest versions sorted by major.minor
     return [f"{version}" for version in sorted(latest_versions.values())]
 
-def get_firefox_verions(app_name, channel, min_version):
+
+def get_firefox_verions(versions, app_name, channel, min_version):
     test_versions = set()
-    non_desktop_beta = [f"{Version(list(versions.keys())[-1]).major +1}.0b"]
-    
+    non_desktop_beta = [f"{Version(list(versions.keys())[-1]).major + 1}.0b"]
+
     if "firefox_ios" in app_name:
         # Get list of versions from requested to current based on whattrainisitnow
         for version in reversed(versions.keys()):
             version = Version(version)
             if version.major > Version(min_version).major:
                 test_versions.add(version.major)
-        if not test_versions: # if the version doesn't exist in whattrainisitnow just return it
-           return [f"{Version(min_version)}"]
+        if not test_versions:  # if the version doesn't exist in whattrainisitnow just return it
+            return [f"{Version(min_version)}"]
         else:
             return [f"{_}" for _ in test_versions if _ >= 128]
     else:
@@ -92,7 +236,7 @@ def get_firefox_verions(app_name, channel, min_version):
             case "release":
                 test_versions = get_latest_versions(versions, min_version)
                 if "desktop" in app_name:
-                    test_versions.extend(['latest', 'latest-beta'])
+                    test_versions.extend(["latest", "latest-beta"])
                 return test_versions
             case "nightly":
                 return "['latest']"
@@ -101,85 +245,117 @@ def get_firefox_verions(app_name, channel, min_version):
                     return "['latest-beta']"
                 return non_desktop_beta
 
-# Load string of last experiment
-try:
-    with open('previous_experiment.txt') as f:
-        previous_experiment = f.read()
-except FileNotFoundError:
-    subprocess.run([f"touch {path}"], encoding="utf8", shell=True)
-    previous_experiment = []
-
-# Query Experimenter API
-current_experiments = requests.get(experimenter_url).json()
 
-# check if newest experiment is different
-if current_experiments[-1]["slug"] not in previous_experiment:
-    run_flag = True
-
-#  Exit if the experiment is the same
-if not run_flag:
-    exit
-
-# Sorted list of experiments that have a publishedDate field
-experiments = [_ for _ in current_experiments if _['publishedDate'] is not None]
-experiments = sorted(experiments, key=lambda _: parser.isoparse(_.get('publishedDate')))
-current_experiments = []
-
-for experiment in experiments:
-    try:
-        if parser.parse(experiment.get("startDate")) >= datetime.now() - timedelta(days=7):
-            current_experiments.append(experiment)
-    except TypeError:
-        continue
+def published_experiments(current_experiments):
+    # Sorted list of experiments that have a publishedDate field
+    experiments = [_ for _ in current_experiments if _["publishedDate"] is not None]
+    return sorted(experiments, key=lambda _: parser.isoparse(_.get("publishedDate")))
 
 
-temp_experiments_list = []
-for count, item in enumerate(current_experiments):
-    if not item.get('isRollout'):
-        temp_experiments_list.append(item)
+def recent_experiments(experiments):
+    """Experiments, not rollouts, started in the last week."""
+    recent = []
 
-current_experiments = temp_experiments_list
+    for experiment in experiments:
+        try:
+            if parser.parse(experiment.get("startDate")) >= datetime.now() - timedelta(days=7):
+                recent.append(experiment)
+        except TypeError:
+            continue
 
+    return [item for item in recent if not item.get("isRollout")]
 
-#  Trigger job based on application
-#  Get list of experiments to run tests on
-for experiment in reversed(current_experiments):
-    if experiment["slug"] != previous_experiment:
-        testing_list[experiment["slug"]] = experiment
-    else:
-        break
 
-for slug, data in testing_list.items():
-    ff_version = None
+def dispatches(versions, slug, data):
+    """The workflow dispatches needed to test one experiment."""
     desktop_workflows = ["windows_manual.yml", "linux_manual.yml"]
 
     try:
         ff_version = [re.search(r"versionCompare\('(\d+).!'\)", data["targeting"]).group(1)]
     except AttributeError:
-        continue  # Don't test experiments with no target version
+        return []  # Don't test experiments with no target version
 
-    branches = f"{[item["slug"] for item in data["branches"]]}"
+    branches = f"{[item['slug'] for item in data['branches']]}"
     match data["appName"]:
         case "firefox_desktop":
-            for workflow_id in desktop_workflows:
-                trigger_github_action(
-                    slug, branches, get_firefox_verions(data["appName"], data["channel"], ff_version), workflow_id
+            return [
+                (
+                    slug,
+                    branches,
+                    get_firefox_verions(versions, data["appName"], data["channel"], ff_version),
+                    workflow_id,
                 )
+                for workflow_id in desktop_workflows
+            ]
         case "firefox_ios":
-            workflow_id = "ios_manual.yml"
             _ff_version = Version(ff_version[0])
-            trigger_github_action(
-                slug, branches, get_firefox_verions(data["appName"], data["channel"], f"{_ff_version.major}"), workflow_id
-            )
+            return [
+                (
+                    slug,
+                    branches,
+                    get_firefox_verions(
+                        versions, data["appName"], data["channel"], f"{_ff_version.major}"
+                    ),
+                    "ios_manual.yml",
+                )
+            ]
         case "fenix":
-            workflow_id = "android_manual.yml"
-            _ff_version = Version(ff_version[0])
-            trigger_github_action(
-                slug, branches, get_firefox_verions(data["appName"], data["channel"], ff_version), workflow_id
-            )
-    time.sleep(30)
-#  Write last experiment to file for next cron run
-with open('previous_experiment.txt', 'w') as f:
-    f.writelines(experiments[-1]["slug"])
+            return [
+                (
+                    slug,
+                    branches,
+                    get_firefox_verions(versions, data["appName"], data["channel"], ff_version),
+                    "android_manual.yml",
+                )
+            ]
+    return []
+
+
+def version_list(firefox_versions):
+    """Versions as a list, some channels give them as a list literal string."""
+    if isinstance(firefox_versions, str):
+        return ast.literal_eval(firefox_versions)
+    return list(firefox_versions)
+
+
+def main():
+    session = make_session()
+    cache = ResponseCache(session, CACHE_DIR)
+    versions = cache.get(versions_url)
+    state = ExperimentState(STATE_FILE)
+
+    # Query Experimenter API
+    current_experiments = cache.get(experimenter_url)
+    state.prune({experiment["slug"] for experiment in current_experiments})
+
+    #  Work out the (experiment, version, workflow) combinations not tested yet
+    jobs = []
+    for experiment in recent_experiments(published_experiments(current_experiments)):
+        for slug, branches, firefox_versions, workflow_id in dispatches(
+            versions, experiment["slug"], experiment
+        ):
+            if untested := state.untested(
+                slug, experiment, workflow_id, version_list(firefox_versions)
+            ):
+                jobs.append((experiment, branches, untested, workflow_id))
+
+    if not jobs:
+        print("No new experiment or Firefox version to test")
+        state.save()
+        return
+
+    def dispatch(job):
+        experiment, branches, untested, workflow_id = job
+        slug = experiment["slug"]
+        if trigger_github_action(session, limiter, slug, branches, untested, workflow_id):
+            state.mark_tested(slug, experiment, workflow_id, untested)
+
+    #  Trigger jobs based on application
+    limiter = RateLimiter(DISPATCH_INTERVAL)
+    with ThreadPoolExecutor(max_workers=DISPATCH_WORKERS) as executor:
+        list(executor.map(dispatch, jobs))
+    state.save()
+
 
-print(f"Last experiment checked was {experiments[-1]['slug']}")
+if __name__ == "__main__":
+    main()